@@ -0,0 +1,138 @@
+import gzip
+import json
+
+# Optional dependencies, the compact formats they provide are only offered if they are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Media types that can be negotiated for a list of stories
+JSON_TYPE = "application/json"
+COLUMNAR_TYPE = "application/vnd.news.columnar+json"
+MSGPACK_TYPE = "application/msgpack"
+MSGPACK_TYPES = [MSGPACK_TYPE, "application/x-msgpack"]
+
+# Fields of a story in the order they are stored in a row or column list
+STORY_FIELDS = ["key", "headline", "story_cat", "story_region", "author", "story_date", "story_details"]
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+# Get the media types offered by the server, in order of preference when the client has no preference
+def available_types():
+    types = []
+    if msgpack is not None:
+        types += MSGPACK_TYPES
+    types += [COLUMNAR_TYPE, JSON_TYPE]
+    return types
+
+
+# Get the content encodings offered by the server, in order of preference
+def available_encodings():
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+# Parse an Accept or Accept-Encoding header into a list of values ordered by their q parameter
+def parse_header(header):
+    values = []
+    for position, part in enumerate(header.split(",")):
+        params = part.strip().split(";")
+        value = params[0].strip().lower()
+        if not value:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, number = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            values.append((-quality, position, value))
+    return [value for _, _, value in sorted(values)]
+
+
+# Choose the media type to respond with, falling back to the row JSON format
+def negotiate_type(accept):
+    offered = available_types()
+    for media_type in parse_header(accept or ""):
+        if media_type in offered:
+            return media_type
+    return JSON_TYPE
+
+
+# Choose the content encoding to respond with in the client's order of preference, with * meaning the server's
+# preferred encoding, or None to send the body uncompressed
+def negotiate_encoding(accept_encoding):
+    offered = available_encodings()
+    for encoding in parse_header(accept_encoding or ""):
+        if encoding == "*":
+            return offered[0]
+        if encoding in offered:
+            return encoding
+    return None
+
+
+# Build the row payload, a list of objects with the field names repeated for every story
+def rows_payload(rows):
+    return {"stories": [dict(zip(STORY_FIELDS, row)) for row in rows]}
+
+
+# Build the columnar payload, each field name stored once with a list of values for every story
+def columnar_payload(rows):
+    columns = list(zip(*rows)) if rows else [() for _ in STORY_FIELDS]
+    return {"count": len(rows), "stories": {field: list(column) for field, column in zip(STORY_FIELDS, columns)}}
+
+
+# Convert a columnar payload back into a list of story dictionaries, raising ValueError if it isn't columnar
+def columnar_to_rows(payload):
+    stories = payload.get("stories") if isinstance(payload, dict) else None
+    if not isinstance(stories, dict) or not all(isinstance(column, list) for column in stories.values()):
+        raise ValueError("Payload is not in the columnar format")
+    fields = list(stories.keys())
+    return [dict(zip(fields, values)) for values in zip(*(stories[field] for field in fields))]
+
+
+# Serialise a list of story rows in the given media type
+def encode_stories(rows, media_type):
+    if media_type in MSGPACK_TYPES:
+        return msgpack.packb(columnar_payload(rows), use_bin_type=True)
+    if media_type == COLUMNAR_TYPE:
+        return json.dumps(columnar_payload(rows), separators=(",", ":")).encode("utf-8")
+    return json.dumps(rows_payload(rows)).encode("utf-8")
+
+
+# Decode a body of the given media type into a list of story dictionaries, raising ValueError if it is malformed
+def decode_stories(body, media_type):
+    media_type = (media_type or JSON_TYPE).split(";")[0].strip().lower()
+    if media_type in MSGPACK_TYPES:
+        if msgpack is None:
+            raise ValueError("MessagePack payload but msgpack isn't installed")
+        return columnar_to_rows(msgpack.unpackb(body, raw=False))
+    payload = json.loads(body)
+    if media_type == COLUMNAR_TYPE:
+        return columnar_to_rows(payload)
+    stories = payload.get("stories") if isinstance(payload, dict) else None
+    if not isinstance(stories, list) or not all(isinstance(story, dict) for story in stories):
+        raise ValueError("Payload has no list of stories")
+    return stories
+
+
+# Compress a body with the given content encoding
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
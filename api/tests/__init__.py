@@ -0,0 +1 @@
+FEED_URL = "/api/stories?story_cat=*&story_region=*&story_date=*"
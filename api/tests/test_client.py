@@ -0,0 +1,364 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+import client
+from api import formats
+
+
+# Response from a news service, as returned by the client's transport
+def fake_response(status_code=200, content=b"", content_type=formats.JSON_TYPE):
+    response = mock.Mock(status_code=status_code, content=content, headers={"Content-Type": content_type})
+    response.text = content.decode("utf-8", "replace")
+    response.json = lambda: formats.json.loads(content)
+    return response
+
+
+class ClientTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.client = client.Client(store_path=os.path.join(directory.name, "store.sqlite3"), interactive=False)
+
+
+class DedupeTimelineTests(SimpleTestCase):
+    def story(self, agency_code, headline, story_date):
+        return {"agency_code": agency_code, "agency_name": f"Agency {agency_code}", "headline": headline,
+                "date": story_date}
+
+    def test_headline_key_keeps_word_order(self):
+        self.assertEqual(client.headline_key("The Dog bites a man!"), client.headline_key("dog bites man"))
+        self.assertNotEqual(client.headline_key("Dog bites man"), client.headline_key("Man bites dog"))
+
+    def test_copies_from_other_agencies_are_merged(self):
+        timeline = client.dedupe_timeline([self.story("AG01", "Dog bites man", "2024-01-01"),
+                                           self.story("AG02", "DOG BITES MAN", "2024-01-02"),
+                                           self.story("AG03", "Man bites dog", "2024-01-02")])
+        self.assertEqual([story["agency_code"] for story in timeline], ["AG01", "AG03"])
+        self.assertEqual(timeline[0]["also_from"], ["Agency AG02"])
+        self.assertEqual(timeline[1]["also_from"], [])
+
+    def test_copies_from_the_same_agency_are_kept(self):
+        timeline = client.dedupe_timeline([self.story("AG01", "Dog bites man", "2024-01-01"),
+                                           self.story("AG01", "Dog bites man", "2024-01-01")])
+        self.assertEqual(len(timeline), 2)
+
+    def test_copies_outside_the_window_are_kept(self):
+        later = (date(2024, 1, 1) + timedelta(days=client.DUPLICATE_WINDOW_DAYS + 1)).isoformat()
+        timeline = client.dedupe_timeline([self.story("AG01", "Dog bites man", "2024-01-01"),
+                                           self.story("AG02", "Dog bites man", later)])
+        self.assertEqual(len(timeline), 2)
+
+    def test_stories_without_a_date_or_headline_pass_through(self):
+        stories = [self.story("AG01", "Dog bites man", None), self.story("AG02", "Dog bites man", None),
+                   self.story("AG01", None, "2024-01-01"), self.story("AG02", "", "2024-01-01")]
+        timeline = client.dedupe_timeline(stories)
+        self.assertEqual(timeline, stories)
+        self.assertTrue(all(story["also_from"] == [] for story in timeline))
+
+
+class StoryStoreTests(ClientTestCase):
+    agency = {"agency_name": "Agency", "url": "https://agency.example", "agency_code": "AG01"}
+    other = {"agency_name": "Other", "url": "https://other.example", "agency_code": "OT01"}
+
+    def story(self, key, story_date, headline="Headline"):
+        return {"key": key, "headline": headline, "story_cat": "pol", "story_region": "uk", "author": "Author",
+                "story_date": story_date, "story_details": "Details"}
+
+    def stored(self, agency_code="AG01"):
+        return {story["story_key"]: story for story in self.client.store.query(agency_code=agency_code)}
+
+    def test_sync_window_starts_a_day_before_the_last_sync(self):
+        store = self.client.store
+        self.assertIsNone(store.sync_window_start("AG01"))
+        with mock.patch("client.time.time", return_value=datetime(2024, 1, 10, 12).timestamp()):
+            store.save_stories(self.agency, [], None)
+        self.assertEqual(store.sync_window_start("AG01"), date(2024, 1, 9))
+
+    def test_sync_replaces_stories_in_the_window(self):
+        store = self.client.store
+        store.save_stories(self.agency, [self.story(1, "01/01/2024"), self.story(2, "10/01/2024"),
+                                         self.story(3, "11/01/2024"), self.story(4, "not a date")], None)
+        store.save_stories(self.other, [self.story(2, "10/01/2024")], None)
+
+        # Story 2 was deleted from the news service and story 3 was edited
+        added = store.save_stories(self.agency, [self.story(3, "11/01/2024", headline="Edited")], date(2024, 1, 10))
+        self.assertEqual(added, 1)
+        stories = self.stored()
+        self.assertEqual(sorted(stories), ["1", "3", "4"])
+        self.assertEqual(stories["3"]["headline"], "Edited")
+        self.assertIsNone(stories["4"]["date"])
+        self.assertEqual(stories["4"]["raw_date"], "not a date")
+        self.assertEqual(list(self.stored("OT01")), ["2"])
+
+    def test_full_sync_replaces_every_story_of_the_agency(self):
+        store = self.client.store
+        store.save_stories(self.agency, [self.story(1, "01/01/2024"), self.story(2, "not a date")], None)
+        store.save_stories(self.other, [self.story(1, "01/01/2024")], None)
+        store.save_stories(self.agency, [self.story(3, "01/01/2024"), {"headline": "No key"}], None)
+        self.assertEqual(list(self.stored()), ["3"])
+        self.assertEqual(list(self.stored("OT01")), ["1"])
+
+    def test_empty_store_is_synced_before_querying(self):
+        with mock.patch.object(self.client, "sync_stories") as sync_stories, \
+                mock.patch.object(self.client, "start_background_sync") as start_background_sync:
+            self.client.query_stories()
+        sync_stories.assert_called_once_with(verbose=False)
+        start_background_sync.assert_not_called()
+
+    def test_stale_store_is_synced_in_the_background(self):
+        now = time.time()
+        with mock.patch("client.time.time", return_value=now - client.STORE_MAX_AGE - 1):
+            self.client.store.save_stories(self.agency, [self.story(1, "01/01/2024")], None)
+        with mock.patch.object(self.client, "sync_stories") as sync_stories, \
+                mock.patch.object(self.client, "start_background_sync") as start_background_sync:
+            timeline, found = self.client.query_stories()
+            self.assertEqual(found, 1)
+            start_background_sync.assert_called_once_with()
+
+            # A fresh store is queried without syncing
+            self.client.store.save_stories(self.agency, [self.story(1, "01/01/2024")], None)
+            self.client.query_stories()
+            start_background_sync.assert_called_once_with()
+        sync_stories.assert_not_called()
+
+
+class CircuitBreakerTests(ClientTestCase):
+    agencies = [{"agency_name": "Down", "url": "https://down.example", "agency_code": "DN01"},
+                {"agency_name": "Up", "url": "https://up.example", "agency_code": "UP01"}]
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1_700_000_000.0
+        patcher = mock.patch("client.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def state(self, agency_code):
+        return client.circuit_state(self.client.store.get_health().get(agency_code))
+
+    def fail(self, agency_code, times=client.CIRCUIT_FAILURES):
+        for _ in range(times):
+            self.client.store.record_fetch(agency_code, 1.0, False)
+
+    def synced_codes(self, **kwargs):
+        with mock.patch.object(self.client, "fetch_stories", return_value=([], None)) as fetch_stories:
+            self.client.sync_stories(agencies=[dict(agency) for agency in self.agencies], verbose=False, **kwargs)
+        return sorted(call.args[0]["agency_code"] for call in fetch_stories.call_args_list)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self.assertEqual(self.state("DN01"), "closed")
+        self.fail("DN01", client.CIRCUIT_FAILURES - 1)
+        self.assertEqual(self.state("DN01"), "closed")
+        self.fail("DN01", 1)
+        self.assertEqual(self.state("DN01"), "open")
+
+    def test_open_agency_is_skipped_unless_asked_for(self):
+        self.fail("DN01")
+        self.assertEqual(self.synced_codes(), ["UP01"])
+        self.assertEqual(self.synced_codes(agency_id="DN01"), ["DN01"])
+
+    def test_successful_probe_closes_circuit(self):
+        self.fail("DN01")
+        self.now += client.CIRCUIT_OPEN_SECONDS
+        self.assertEqual(self.state("DN01"), "half-open")
+        self.assertEqual(self.synced_codes(), ["DN01", "UP01"])
+        self.assertEqual(self.state("DN01"), "closed")
+        self.assertEqual(self.client.store.get_health()["DN01"]["failures"], 0)
+
+    def test_failed_probe_reopens_circuit(self):
+        self.fail("DN01")
+        self.now += client.CIRCUIT_OPEN_SECONDS
+        self.fail("DN01", 1)
+        self.assertEqual(self.state("DN01"), "open")
+        self.assertEqual(self.client.store.get_health()["DN01"]["opened_at"], self.now)
+
+    def test_agencies_are_ordered_by_error_rate_then_latency(self):
+        store = self.client.store
+        store.record_fetch("SLOW", 2.0, True)
+        store.record_fetch("FAST", 0.1, True)
+        store.record_fetch("FLAKY", 0.1, True)
+        store.record_fetch("FLAKY", 0.1, False)
+        self.fail("DEAD")
+        self.now += client.CIRCUIT_OPEN_SECONDS
+        agencies = [{"agency_code": code} for code in ["DEAD", "FLAKY", "NEW", "SLOW", "FAST"]]
+        ordered, skipped = self.client.order_agencies(agencies)
+        self.assertEqual([agency["agency_code"] for agency in ordered], ["FAST", "SLOW", "NEW", "FLAKY", "DEAD"])
+        self.assertEqual(skipped, [])
+
+
+class FetchStoriesTests(ClientTestCase):
+    agency = {"agency_name": "Agency", "url": "https://agency.example/", "agency_code": "AG01"}
+
+    def fetch(self, response):
+        with mock.patch.object(self.client.session, "get", return_value=response):
+            return self.client.fetch_stories(dict(self.agency))
+
+    def test_decodes_columnar_response(self):
+        body = formats.encode_stories([(1, "Headline", "pol", "uk", "author", "01/01/2024", "Details")],
+                                      formats.COLUMNAR_TYPE)
+        stories, error = self.fetch(fake_response(content=body, content_type=formats.COLUMNAR_TYPE))
+        self.assertIsNone(error)
+        self.assertEqual(stories[0]["headline"], "Headline")
+
+    def test_mislabelled_response_is_an_error(self):
+        body = formats.encode_stories([(1, "Headline", "pol", "uk", "author", "01/01/2024", "Details")],
+                                      formats.JSON_TYPE)
+        stories, error = self.fetch(fake_response(content=body, content_type=formats.COLUMNAR_TYPE))
+        self.assertIsNone(stories)
+        self.assertIn("invalid story payload", error)
+
+    def test_no_stories(self):
+        self.assertEqual(self.fetch(fake_response(status_code=404, content=b"No stories found")), ([], None))
+
+
+class SyncStoriesTests(ClientTestCase):
+    agencies = [{"agency_name": "Slow", "url": "https://slow.example", "agency_code": "SL01"},
+                {"agency_name": "Fast", "url": "https://fast.example", "agency_code": "FA01"}]
+
+    def test_agencies_are_fetched_concurrently(self):
+        # Each fetch waits for the other to start, so fetching one agency after another would break the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fetch_stories(agency, **kwargs):
+            barrier.wait()
+            return [{"key": 1, "headline": f"{agency['agency_name']} headline", "story_date": "01/01/2024"}], None
+
+        with mock.patch.object(self.client, "fetch_stories", side_effect=fetch_stories):
+            self.client.sync_stories(agencies=[dict(agency) for agency in self.agencies], verbose=False)
+        self.assertEqual(set(self.client.store.get_health()), {"SL01", "FA01"})
+        timeline, found = self.client.query_stories()
+        self.assertEqual(sorted(story["headline"] for story in timeline), ["Fast headline", "Slow headline"])
+
+
+class BatchTests(ClientTestCase):
+    story = {"headline": "Headline", "category": "pol", "region": "uk", "details": "Details"}
+
+    def run_batch(self, operations, concurrency=4):
+        lines = [operation if isinstance(operation, str) else json.dumps(operation) for operation in operations]
+        output = io.StringIO()
+        all_ok = client.run_batch(self.client, io.StringIO("\n".join(lines) + "\n"), output, concurrency=concurrency)
+        return all_ok, [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_results_are_in_input_order(self):
+        self.client.logged_in_url = "agency.example"
+
+        # Later posts finish first
+        def send_story(story):
+            time.sleep((10 - int(story["headline"])) / 1000)
+            return fake_response(status_code=201, content=b"Story created")
+
+        stories = [{**self.story, "headline": str(number)} for number in range(10)]
+        with mock.patch.object(self.client, "send_story", side_effect=send_story):
+            all_ok, results = self.run_batch(stories)
+        self.assertTrue(all_ok)
+        self.assertEqual([result["line"] for result in results], list(range(1, 11)))
+        self.assertTrue(all(result["ok"] and result["status"] == 201 for result in results))
+
+    def test_commands_wait_for_earlier_posts(self):
+        self.client.logged_in_url = "agency.example"
+        sent = []
+
+        def send_story(story):
+            time.sleep(0.01)
+            sent.append("post")
+            return fake_response(status_code=201)
+
+        def send_logout():
+            sent.append("logout")
+            return fake_response(status_code=200)
+
+        with mock.patch.object(self.client, "send_story", side_effect=send_story), \
+                mock.patch.object(self.client, "send_logout", side_effect=send_logout):
+            all_ok, results = self.run_batch([self.story] * 5 + [{"command": "logout"}])
+        self.assertTrue(all_ok)
+        self.assertEqual(sent, ["post"] * 5 + ["logout"])
+
+    def test_bad_lines_fail_without_stopping_the_batch(self):
+        with mock.patch.object(self.client.session, "post", return_value=fake_response(status_code=200)):
+            all_ok, results = self.run_batch([
+                "not json", "[1]", {"command": "login", "url": 5}, {"command": "login"}, {"command": "fly"},
+                {"command": "delete", "key": 1}, self.story,
+                {"command": "login", "url": "agency.example", "username": "user", "password": "password"}])
+        self.assertFalse(all_ok)
+        self.assertEqual([result.get("error") for result in results], [
+            "Invalid JSON", "Invalid JSON", "Invalid field value type", "Missing field 'url'", "Invalid command fly",
+            "Not logged in to a news service", "Not logged in to a news service", None])
+        self.assertTrue(results[-1]["ok"])
+
+    def test_sync_reports_agency_errors_without_printing(self):
+        directory = fake_response(content=json.dumps([{"agency_name": "Agency", "url": "https://agency.example",
+                                                       "agency_code": "AG01"}]).encode())
+        output = io.StringIO()
+        with mock.patch.object(self.client.session, "get", return_value=directory), \
+                mock.patch.object(self.client, "fetch_stories", return_value=(None, "Agency is down")), \
+                redirect_stdout(output):
+            all_ok, results = self.run_batch([{"command": "sync"}])
+        self.assertFalse(all_ok)
+        self.assertEqual(results[0]["errors"], ["Agency is down"])
+        self.assertEqual(output.getvalue(), "")
+
+    def test_exit_status(self):
+        batch = os.path.join(os.path.dirname(self.client.store.path), "batch.jsonl")
+        for line, status in [('{"command": "logout"}', 1),
+                             ('{"command": "login", "url": "agency.example", "username": "u", "password": "p"}', 0)]:
+            with open(batch, "w") as batch_file:
+                batch_file.write(line + "\n")
+            argv = ["client.py", "--batch", batch, "--output", os.devnull]
+            with mock.patch.object(client, "Client", return_value=self.client), mock.patch("sys.argv", argv), \
+                    mock.patch.object(self.client.session, "post", return_value=fake_response(status_code=200)):
+                with self.assertRaises(SystemExit) as exit_context:
+                    client.main()
+            self.assertEqual(exit_context.exception.code, status)
+
+
+class TransportTests(SimpleTestCase):
+    def test_stats_keep_a_window_of_latencies(self):
+        stats = client.TransportStats()
+        for number in range(client.LATENCY_WINDOW + 500):
+            stats.record("host", number / 1000, number % 2 == 0)
+        self.assertEqual(len(stats.hosts["host"]["latencies"]), client.LATENCY_WINDOW)
+        summary = stats.summary()[0]
+        self.assertEqual(summary["requests"], client.LATENCY_WINDOW + 500)
+        self.assertEqual(summary["errors"], (client.LATENCY_WINDOW + 500) // 2)
+        self.assertEqual(summary["max_ms"], client.LATENCY_WINDOW + 499)
+
+    def test_http2_without_h2_raises_runtime_error(self):
+        httpx = mock.Mock()
+        httpx.Client.side_effect = ImportError("Using http2=True, but the 'h2' package is not installed")
+        with mock.patch.object(client, "httpx", httpx):
+            with self.assertRaisesRegex(RuntimeError, "httpx\\[http2\\]"):
+                client.Transport(http2=True)
+        with mock.patch.object(client, "httpx", None):
+            with self.assertRaises(RuntimeError):
+                client.Transport(http2=True)
+
+    @mock.patch("client.time.sleep")
+    def test_rate_limited_posts_are_retried_after_retry_after(self, sleep):
+        transport = client.Transport()
+        limited = fake_response(status_code=429, content=b"Too many requests")
+        limited.headers["Retry-After"] = "2"
+        created = fake_response(status_code=201, content=b"Story created")
+        with mock.patch.object(transport.client, "request", side_effect=[limited, created]):
+            self.assertEqual(transport.post("https://agency.example/api/stories").status_code, 201)
+        sleep.assert_called_once_with(2.0)
+
+    @mock.patch("client.time.sleep")
+    def test_rate_limited_requests_have_their_own_retries(self, sleep):
+        transport = client.Transport()
+        limited = fake_response(status_code=429, content=b"Too many requests")
+        limited.headers["Retry-After"] = "1"
+        created = fake_response(status_code=201, content=b"Story created")
+        responses = [limited] * client.RATE_LIMIT_RETRIES + [created]
+        with mock.patch.object(transport.client, "request", side_effect=responses):
+            self.assertEqual(transport.post("https://agency.example/api/stories").status_code, 201)
+        with mock.patch.object(transport.client, "request", return_value=limited):
+            self.assertEqual(transport.post("https://agency.example/api/stories").status_code, 429)
@@ -0,0 +1,119 @@
+import gzip
+import json
+from datetime import date
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api import formats
+from api.models import Author, Story
+from api.tests import FEED_URL
+
+ROWS = [
+    (1, "First headline", "pol", "uk", "author", "01/01/2024", "First details"),
+    (2, "Second headline", "art", "eu", "author", "02/01/2024", "Second details"),
+]
+
+STORIES = [dict(zip(formats.STORY_FIELDS, row)) for row in ROWS]
+
+
+class NegotiationTests(SimpleTestCase):
+    def test_parse_header_orders_by_quality_then_position(self):
+        self.assertEqual(formats.parse_header("a;q=0.5, b, c;q=0.9, d"), ["b", "d", "c", "a"])
+
+    def test_parse_header_drops_zero_and_invalid_quality(self):
+        self.assertEqual(formats.parse_header("a;q=0, b;q=bad, c;q=0.1"), ["c"])
+
+    def test_negotiate_type_picks_the_preferred_offered_type(self):
+        accept = f"text/html, {formats.COLUMNAR_TYPE};q=0.9, {formats.JSON_TYPE};q=0.5"
+        self.assertEqual(formats.negotiate_type(accept), formats.COLUMNAR_TYPE)
+
+    def test_negotiate_type_falls_back_to_json(self):
+        self.assertEqual(formats.negotiate_type(None), formats.JSON_TYPE)
+        self.assertEqual(formats.negotiate_type("*/*"), formats.JSON_TYPE)
+        self.assertEqual(formats.negotiate_type(f"{formats.COLUMNAR_TYPE};q=0"), formats.JSON_TYPE)
+
+    @skipUnless(formats.msgpack is not None, "needs msgpack")
+    def test_negotiate_type_offers_msgpack(self):
+        self.assertEqual(formats.negotiate_type(f"{formats.MSGPACK_TYPE}, {formats.JSON_TYPE};q=0.5"),
+                         formats.MSGPACK_TYPE)
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(formats.negotiate_encoding("gzip, deflate"), "gzip")
+        self.assertIsNone(formats.negotiate_encoding("gzip;q=0, deflate"))
+        self.assertIsNone(formats.negotiate_encoding(None))
+        self.assertEqual(formats.negotiate_encoding("gzip;q=1.0, br;q=0.1"), "gzip")
+        self.assertEqual(formats.negotiate_encoding("deflate, *;q=0.5"), formats.available_encodings()[0])
+
+    @mock.patch("api.formats.brotli", None)
+    def test_negotiate_encoding_without_brotli(self):
+        self.assertEqual(formats.negotiate_encoding("br, gzip;q=0.5"), "gzip")
+
+
+class EncodingTests(SimpleTestCase):
+    def test_json_round_trip(self):
+        body = formats.encode_stories(ROWS, formats.JSON_TYPE)
+        self.assertEqual(json.loads(body), {"stories": STORIES})
+        self.assertEqual(formats.decode_stories(body, "application/json; charset=utf-8"), STORIES)
+
+    def test_columnar_round_trip(self):
+        body = formats.encode_stories(ROWS, formats.COLUMNAR_TYPE)
+        self.assertEqual(json.loads(body)["stories"]["headline"], ["First headline", "Second headline"])
+        self.assertEqual(formats.decode_stories(body, formats.COLUMNAR_TYPE), STORIES)
+
+    def test_columnar_round_trip_without_stories(self):
+        body = formats.encode_stories([], formats.COLUMNAR_TYPE)
+        self.assertEqual(formats.decode_stories(body, formats.COLUMNAR_TYPE), [])
+
+    @skipUnless(formats.msgpack is not None, "needs msgpack")
+    def test_msgpack_round_trip(self):
+        body = formats.encode_stories(ROWS, formats.MSGPACK_TYPE)
+        self.assertEqual(formats.decode_stories(body, "application/x-msgpack"), STORIES)
+
+    def test_mislabelled_payloads_raise_value_error(self):
+        row_body = formats.encode_stories(ROWS, formats.JSON_TYPE)
+        columnar_body = formats.encode_stories(ROWS, formats.COLUMNAR_TYPE)
+        for body, media_type in [(row_body, formats.COLUMNAR_TYPE), (b"[1, 2]", formats.JSON_TYPE),
+                                 (b'{"stories": "none"}', formats.JSON_TYPE), (b"<html>", formats.JSON_TYPE)]:
+            with self.assertRaises(ValueError):
+                formats.decode_stories(body, media_type)
+        # Columnar JSON labelled as row JSON has no list of stories either
+        with self.assertRaises(ValueError):
+            formats.decode_stories(columnar_body, formats.JSON_TYPE)
+
+    @skipUnless(formats.msgpack is not None, "needs msgpack")
+    def test_mislabelled_msgpack_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            formats.decode_stories(formats.msgpack.packb({"stories": STORIES}), formats.MSGPACK_TYPE)
+        with self.assertRaises(ValueError):
+            formats.decode_stories(b"\xc1", formats.MSGPACK_TYPE)
+
+
+@override_settings(DATABASE_REPLICAS=[], RATE_LIMIT_RATE=0)
+class FeedFormatTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(user=User.objects.create_user("author"))
+
+    def add_stories(self, count):
+        Story.objects.bulk_create([Story(headline=f"Headline {number}", category="pol", region="uk",
+                                         author=self.author, date=date(2024, 1, 1), details="Details")
+                                   for number in range(count)])
+
+    def test_small_feed_is_not_compressed(self):
+        self.add_stories(1)
+        response = self.client.get(FEED_URL, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertLess(len(response.content), formats.MIN_COMPRESS_SIZE)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(json.loads(response.content)["stories"]), 1)
+
+    @mock.patch("api.formats.brotli", None)
+    def test_large_feed_is_compressed(self):
+        self.add_stories(50)
+        response = self.client.get(FEED_URL, HTTP_ACCEPT_ENCODING="gzip",
+                                   HTTP_ACCEPT=formats.COLUMNAR_TYPE)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], formats.COLUMNAR_TYPE)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        stories = formats.decode_stories(gzip.decompress(response.content), response["Content-Type"])
+        self.assertEqual(len(stories), 50)
@@ -0,0 +1,84 @@
+import json
+from datetime import date
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from api.models import Author, Story
+from api.tests import FEED_URL
+from cwk1.routers import ReplicaRouter, pinned_to_primary
+
+# The test runner sets up every database named by a test class, even if the class is skipped
+HAS_REPLICA = "replica1" in settings.DATABASES
+
+
+# Run with cwk1.test_settings, which gives the replica its own SQLite file so it lags behind the primary
+@skipUnless(HAS_REPLICA, "needs the replica database from cwk1.test_settings")
+class ReplicaRoutingTests(TestCase):
+    databases = {"default", "replica1"} if HAS_REPLICA else {"default"}
+
+    def setUp(self):
+        # The same user and author exist in both databases, but each holds a different story
+        for db in ["default", "replica1"]:
+            user = User(id=1, username="author", first_name="Author")
+            user.set_password("password")
+            user.save(using=db)
+            Author(id=1, user_id=1).save(using=db)
+            Story(headline=f"Story in {db}", category="pol", region="uk", author_id=1, date=date(2024, 1, 1),
+                  details="Details").save(using=db)
+
+    def get_headlines(self):
+        response = self.client.get(FEED_URL)
+        self.assertEqual(response.status_code, 200)
+        return [story["headline"] for story in json.loads(response.content)["stories"]]
+
+    def post_story(self):
+        self.client.post("/api/login", {"username": "author", "password": "password"})
+        response = self.client.post("/api/stories", json.dumps({"headline": "New story", "category": "art",
+                                                                "region": "eu", "details": "Details"}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_router_reads_stories_from_replica(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Story), "replica1")
+        self.assertEqual(router.db_for_read(User), "default")
+        self.assertEqual(router.db_for_write(Story), "default")
+
+    def test_router_reads_from_primary_when_pinned(self):
+        token = pinned_to_primary.set(True)
+        try:
+            self.assertEqual(ReplicaRouter().db_for_read(Story), "default")
+        finally:
+            pinned_to_primary.reset(token)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_router_reads_from_primary_without_replicas(self):
+        self.assertEqual(ReplicaRouter().db_for_read(Story), "default")
+
+    def test_feed_reads_from_replica(self):
+        self.assertEqual(self.get_headlines(), ["Story in replica1"])
+
+    def test_post_writes_to_primary(self):
+        self.post_story()
+        self.assertTrue(Story.objects.using("default").filter(headline="New story").exists())
+        self.assertFalse(Story.objects.using("replica1").filter(headline="New story").exists())
+
+    def test_feed_reads_own_writes_after_post(self):
+        self.post_story()
+        self.assertIn("New story", self.get_headlines())
+
+    def test_feed_reads_own_writes_after_delete(self):
+        self.client.post("/api/login", {"username": "author", "password": "password"})
+        story = Story.objects.using("default").get(headline="Story in default")
+        response = self.client.delete(f"/api/stories/{story.id}")
+        self.assertEqual(response.status_code, 200)
+        # The primary has no stories left, the replica still has its story
+        self.assertEqual(self.client.get(FEED_URL).status_code, 404)
+
+    @override_settings(REPLICA_LAG_SECONDS=0)
+    def test_feed_reads_from_replica_once_lag_has_passed(self):
+        self.post_story()
+        self.assertEqual(self.get_headlines(), ["Story in replica1"])
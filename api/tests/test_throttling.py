@@ -0,0 +1,117 @@
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api.models import Author
+from api.tests import FEED_URL
+from api.throttling import CacheStore, LocalStore, SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        # Start every call together, and keep the first in flight long enough for the others to join it
+        barrier = threading.Barrier(6)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+
+        results = []
+
+        def call():
+            barrier.wait()
+            results.append(flight.do("key", compute))
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 6)
+
+    def test_later_calls_compute_again(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+        self.assertEqual(flight.do("key", lambda: 2), 2)
+
+    def test_errors_are_raised(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("key", mock.Mock(side_effect=ValueError))
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_local_store_allows_burst_then_refills(self):
+        store = LocalStore()
+        with mock.patch("api.throttling.time.monotonic", return_value=100.0):
+            self.assertEqual([store.take("client", 2, 3)[0] for _ in range(4)], [True, True, True, False])
+            self.assertEqual(store.take("client", 2, 3), (False, 0.5))
+        with mock.patch("api.throttling.time.monotonic", return_value=100.5):
+            self.assertTrue(store.take("client", 2, 3)[0])
+            self.assertTrue(store.take("other", 2, 3)[0])
+
+    def test_local_store_forgets_idle_buckets(self):
+        store = LocalStore()
+        with mock.patch("api.throttling.time.monotonic", return_value=100.0):
+            for client in range(100):
+                store.take(client, 2, 4)
+        with mock.patch("api.throttling.time.monotonic", return_value=102.0):
+            self.assertEqual(store.take("client", 2, 4), (True, 0))
+        self.assertEqual(list(store.buckets), ["client"])
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_cache_store_allows_burst_then_refills(self):
+        store = CacheStore()
+        with mock.patch("api.throttling.time.time", return_value=100.0):
+            self.assertEqual([store.take("client", 2, 3)[0] for _ in range(4)], [True, True, True, False])
+        with mock.patch("api.throttling.time.time", return_value=100.5):
+            self.assertTrue(store.take("client", 2, 3)[0])
+
+
+# Reads go to the default database whatever the settings, so the tests don't need a replica
+@override_settings(RATE_LIMIT_RATE=1, RATE_LIMIT_BURST=2, DATABASE_REPLICAS=[])
+class RateLimitTests(TestCase):
+    def test_requests_over_limit_get_429(self):
+        statuses = [self.client.get(FEED_URL, REMOTE_ADDR="10.0.0.1").status_code for _ in range(3)]
+        self.assertEqual(statuses, [404, 404, 429])
+
+        response = self.client.get(FEED_URL, REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response["Retry-After"], "1")
+
+        # Other clients have their own limit
+        self.assertEqual(self.client.get(FEED_URL, REMOTE_ADDR="10.0.0.2").status_code, 404)
+
+    def test_made_up_session_cookies_share_the_ip_limit(self):
+        statuses = []
+        for _ in range(3):
+            self.client.cookies["sessionid"] = uuid.uuid4().hex
+            statuses.append(self.client.get(FEED_URL, REMOTE_ADDR="10.0.0.3").status_code)
+        self.assertEqual(statuses, [404, 404, 429])
+
+    def test_logged_in_users_have_their_own_limit(self):
+        user = User.objects.create_user("author", password="password")
+        Author.objects.create(user=user)
+        self.client.post("/api/login", {"username": "author", "password": "password"}, REMOTE_ADDR="10.0.0.4")
+        statuses = [self.client.get(FEED_URL, REMOTE_ADDR="10.0.0.4").status_code for _ in range(3)]
+        self.assertEqual(statuses, [404, 404, 429])
+        self.client.logout()
+        self.assertEqual(self.client.get(FEED_URL, REMOTE_ADDR="10.0.0.4").status_code, 404)
+
+    def test_writes_are_not_limited(self):
+        statuses = [self.client.delete("/api/stories/1", REMOTE_ADDR="10.0.0.5").status_code for _ in range(3)]
+        self.assertEqual(statuses, [503, 503, 503])
+
+        with override_settings(RATE_LIMIT_METHODS=["GET", "DELETE"]):
+            self.assertEqual(self.client.delete("/api/stories/1", REMOTE_ADDR="10.0.0.6").status_code, 503)
+            self.assertEqual(self.client.delete("/api/stories/1", REMOTE_ADDR="10.0.0.6").status_code, 503)
+            self.assertEqual(self.client.delete("/api/stories/1", REMOTE_ADDR="10.0.0.6").status_code, 429)
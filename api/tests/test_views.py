@@ -0,0 +1,77 @@
+import json
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Author, Story
+
+
+@override_settings(DATABASE_REPLICAS=[], RATE_LIMIT_RATE=0)
+class DeleteStoryTests(TestCase):
+    def setUp(self):
+        self.authors = []
+        for number, username in enumerate(["author", "other"], start=1):
+            user = User(id=number, username=username, first_name=username.title())
+            user.set_password("password")
+            user.save()
+            self.authors.append(Author.objects.create(id=number, user=user))
+        self.own = [self.create_story(self.authors[0], date(2024, 1, day)) for day in [1, 2, 3]]
+        self.foreign = self.create_story(self.authors[1], date(2024, 1, 2))
+        self.client.post("/api/login", {"username": "author", "password": "password"})
+
+    def create_story(self, author, story_date):
+        return Story.objects.create(headline="Headline", category="pol", region="uk", author=author, date=story_date,
+                                    details="Details")
+
+    def delete_batch(self, payload):
+        body = payload if isinstance(payload, str) else json.dumps(payload)
+        return self.client.delete("/api/stories", body, content_type="application/json")
+
+    def assertError(self, response, message):
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.content.decode(), message)
+
+    def test_delete_own_story_in_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(f"/api/stories/{self.own[0].id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Story.objects.filter(id=self.own[0].id).exists())
+        deletes = [query["sql"] for query in queries if query["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 1)
+
+    def test_delete_other_authors_story(self):
+        self.assertError(self.client.delete(f"/api/stories/{self.foreign.id}"), "Only the author can delete this story")
+        self.assertTrue(Story.objects.filter(id=self.foreign.id).exists())
+
+    def test_delete_missing_story(self):
+        self.assertError(self.client.delete("/api/stories/9999"), "Story does not exist")
+        self.assertError(self.client.delete("/api/stories/abc"), "Story does not exist")
+
+    def test_batch_delete_by_keys(self):
+        response = self.delete_batch({"keys": [self.own[0].id, str(self.own[1].id), self.foreign.id, 9999]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"deleted": 2, "not_deleted": [self.foreign.id, 9999]})
+        self.assertEqual(list(Story.objects.values_list("id", flat=True).order_by("id")),
+                         [self.own[2].id, self.foreign.id])
+
+    def test_batch_delete_date_range(self):
+        response = self.delete_batch({"date_from": "02/01/2024", "date_to": "*"})
+        self.assertEqual(json.loads(response.content), {"deleted": 2, "not_deleted": []})
+        self.assertEqual(set(Story.objects.values_list("id", flat=True)), {self.own[0].id, self.foreign.id})
+
+    def test_batch_delete_every_date(self):
+        response = self.delete_batch({"date_from": "*", "date_to": "*"})
+        self.assertEqual(json.loads(response.content), {"deleted": 3, "not_deleted": []})
+        self.assertEqual(list(Story.objects.values_list("id", flat=True)), [self.foreign.id])
+
+    def test_batch_delete_invalid_payloads(self):
+        self.assertError(self.delete_batch("{not json"), "Invalid JSON payload")
+        self.assertError(self.delete_batch({"date_from": "*"}), "Missing required fields")
+        self.assertError(self.delete_batch({"keys": "1,2"}), "Invalid field value type")
+        self.assertError(self.delete_batch({"date_from": "2024-01-01", "date_to": "*"}), "Invalid date format")
+        for key in [True, 2.9, "2.9", None]:
+            self.assertError(self.delete_batch({"keys": [self.own[0].id, key]}), "Invalid field value type")
+        self.assertEqual(Story.objects.count(), 4)
@@ -0,0 +1,125 @@
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+
+# Shares one computation between concurrent calls with the same key, so identical feed requests arriving together
+# run their query and serialisation once. Only calls in the same process can share, e.g. threads of a gthread worker.
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    # Call function, or if a call with the same key is already in flight wait for its result instead
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = function()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+        return call["result"]
+
+
+# Token buckets kept in the memory of this process, so each worker limits clients separately
+class LocalStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.pruned_at = 0.0
+
+    # Take a token from a client's bucket, returning whether one was available and the seconds until one will be
+    def take(self, client, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            # Forget buckets idle long enough to have refilled, as a missing bucket is treated as full
+            refill_time = burst / rate
+            if now - self.pruned_at >= refill_time:
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if now - bucket[1] < refill_time}
+                self.pruned_at = now
+
+            tokens, updated = self.buckets.get(client, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[client] = (tokens - 1, now)
+                return True, 0
+            self.buckets[client] = (tokens, now)
+            return False, (1 - tokens) / rate
+
+
+# Token buckets kept in a Django cache shared by every worker, e.g. redis or memcached, chosen by RATE_LIMIT_CACHE.
+# Reading and updating a bucket isn't atomic, so concurrent requests from one client can occasionally overspend.
+class CacheStore:
+    def __init__(self):
+        self.cache = caches[getattr(settings, "RATE_LIMIT_CACHE", "default")]
+
+    def take(self, client, rate, burst):
+        now = time.time()
+        key = f"ratelimit:{client}"
+        tokens, updated = self.cache.get(key, (burst, now))
+        tokens = min(burst, tokens + max(0, now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Forget the bucket once it would have refilled anyway
+        self.cache.set(key, (tokens, now), timeout=math.ceil(burst / rate) + 1)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+# Stores created for each RATE_LIMIT_STORE setting used
+stores = {}
+
+
+def get_store():
+    path = settings.RATE_LIMIT_STORE
+    if path not in stores:
+        stores[path] = import_string(path)()
+    return stores[path]
+
+
+# Identify the client making a request by its user if it is logged in, otherwise by its IP address. The session
+# cookie isn't used for anonymous clients, as they could send a new made up one with every request.
+def client_id(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+# Decorator limiting each client to RATE_LIMIT_RATE requests per second on average, in bursts of up to
+# RATE_LIMIT_BURST, responding 429 with Retry-After to requests over the limit. Only requests with a method in
+# RATE_LIMIT_METHODS are limited.
+def rate_limit(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if settings.RATE_LIMIT_RATE and request.method in settings.RATE_LIMIT_METHODS:
+            allowed, retry_after = get_store().take(client_id(request), settings.RATE_LIMIT_RATE,
+                                                    settings.RATE_LIMIT_BURST)
+            if not allowed:
+                response = HttpResponse("Too many requests", status=429, content_type="text/plain")
+                response["Retry-After"] = str(math.ceil(retry_after))
+                return response
+        return view(request, *args, **kwargs)
+    return wrapper
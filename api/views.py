@@ -2,10 +2,20 @@ import json
 from datetime import datetime
 from django.contrib.auth import authenticate, login as django_login, logout as django_logout
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.views.decorators.http import require_http_methods
 from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from api import formats
 from api.models import Story, Author
+from api.throttling import SingleFlight, rate_limit
+from cwk1.routers import pinned_to_primary
+
+# Number of stories deleted in each transaction of a batch delete
+BATCH_DELETE_CHUNK_SIZE = 500
+
+# Feed requests currently being built, shared with identical requests arriving meanwhile
+feed_requests = SingleFlight()
 
 
 @require_http_methods(["POST"])
@@ -34,6 +44,7 @@ def logout(request):
         return HttpResponse("Method not allowed, not logged in", status=405, content_type="text/plain")
 
 
+@rate_limit
 @require_http_methods(["GET", "POST", "DELETE"])
 def stories(request, story_id=None):
     # Get stories
@@ -70,26 +81,25 @@ def stories(request, story_id=None):
             filter_args["region"] = story_region
         filter_args["date__gte"] = story_date_obj.strftime("%Y-%m-%d")
 
-        # Get matching stories from the database
-        stories_found = Story.objects.filter(**filter_args).order_by("date")
+        # Negotiate the format and encoding of the response with the client
+        media_type = formats.negotiate_type(request.headers.get("Accept"))
+        encoding = formats.negotiate_encoding(request.headers.get("Accept-Encoding"))
+
+        # Build the response body, sharing it with identical requests already in flight. Requests pinned to the
+        # primary database don't share with those reading from a replica.
+        key = (tuple(sorted(filter_args.items())), media_type, encoding, pinned_to_primary.get())
+        body, encoding = feed_requests.do(key, lambda: feed_body(filter_args, media_type, encoding))
 
         # If not stories found return 404
-        if not stories_found:
+        if body is None:
             return HttpResponse("No stories found", status=404, content_type="text/plain")
 
-        # Return the stories as a JSON payload
-        payload = {"stories": []}
-        for story in stories_found:
-            payload["stories"].append({
-                "key": story.id,
-                "headline": story.headline,
-                "story_cat": story.category,
-                "story_region": story.region,
-                "author": story.author.user.username,
-                "story_date": story.date.strftime("%d/%m/%Y"),
-                "story_details": story.details,
-            })
-        return HttpResponse(json.dumps(payload), status=200, content_type="application/json")
+        # Return the stories in the format and encoding negotiated with the client
+        response = HttpResponse(body, status=200, content_type=media_type)
+        if encoding is not None:
+            response["Content-Encoding"] = encoding
+        patch_vary_headers(response, ["Accept", "Accept-Encoding"])
+        return response
 
     # Post story
     if request.method == "POST":
@@ -147,22 +157,103 @@ def stories(request, story_id=None):
         if not request.user.is_authenticated:
             return HttpResponse("Login required for this endpoint", status=503, content_type="text/plain")
 
+        # Delete a batch of stories if no story_id is given but a JSON payload is
+        if not story_id and request.body:
+            return batch_delete_stories(request)
+
         # Ensure the story_id is present
         if not story_id:
             return HttpResponse("Missing required fields", status=503, content_type="text/plain")
 
-        # Ensure the story_id exists in db
+        # Delete the story if the user is its author, in a single statement
         try:
-            story_to_delete = Story.objects.get(id=story_id)
-        except Story.DoesNotExist:
+            deleted, _ = Story.objects.filter(id=story_id, author__user_id=request.user.id).delete()
+        except ValueError:
             return HttpResponse("Story does not exist", status=503, content_type="text/plain")
 
-        # Ensure the story author is the user
-        if story_to_delete.author.user_id != request.user.id:
+        # If nothing was deleted work out why, either the story_id doesn't exist or the user isn't the author
+        if not deleted:
+            if not Story.objects.filter(id=story_id).exists():
+                return HttpResponse("Story does not exist", status=503, content_type="text/plain")
             return HttpResponse("Only the author can delete this story", status=503, content_type="text/plain")
 
-        # Delete the story
-        story_to_delete.delete()
-
         # Return success
         return HttpResponse("Story deleted successfully", status=200, content_type="text/plain")
+
+
+# Get the body of a feed response for the stories matching the filter, and the encoding it was compressed with,
+# or None if no stories match
+def feed_body(filter_args, media_type, encoding):
+    # Get matching stories from the database, as rows of values in the order of the story fields
+    stories_found = list(Story.objects.filter(**filter_args).order_by("date").values_list(
+        "id", "headline", "category", "region", "author__user__username", "date", "details"))
+    if not stories_found:
+        return None, None
+
+    # Format the dates as dd/mm/yyyy
+    rows = [row[:5] + (row[5].strftime("%d/%m/%Y"),) + row[6:] for row in stories_found]
+
+    # Serialise the stories, compressing them if they are big enough to be worth it
+    body = formats.encode_stories(rows, media_type)
+    if encoding is None or len(body) < formats.MIN_COMPRESS_SIZE:
+        return body, None
+    return formats.compress(body, encoding), encoding
+
+
+# Delete the user's stories listed by key, or all of them in a date range, in chunked transactions
+def batch_delete_stories(request):
+    # Get JSON payload from request and parse into dictionary
+    try:
+        batch = json.loads(request.body.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return HttpResponse("Invalid JSON payload", status=503, content_type="text/plain")
+    if not isinstance(batch, dict):
+        return HttpResponse("Invalid JSON payload", status=503, content_type="text/plain")
+
+    user_stories = Story.objects.filter(author__user_id=request.user.id)
+    deleted = 0
+
+    # Delete stories by key, reporting the keys which don't exist or aren't the user's
+    if "keys" in batch:
+        keys = batch["keys"]
+        if not isinstance(keys, list):
+            return HttpResponse("Invalid field value type", status=503, content_type="text/plain")
+        # Keys may be integers or strings of digits, anything else such as true or 2.9 isn't a story key
+        if not all((isinstance(key, int) and not isinstance(key, bool)) or (isinstance(key, str) and key.isdecimal())
+                   for key in keys):
+            return HttpResponse("Invalid field value type", status=503, content_type="text/plain")
+        keys = [int(key) for key in keys]
+
+        not_deleted = []
+        for start in range(0, len(keys), BATCH_DELETE_CHUNK_SIZE):
+            chunk = keys[start:start + BATCH_DELETE_CHUNK_SIZE]
+            with transaction.atomic():
+                owned = set(user_stories.filter(id__in=chunk).values_list("id", flat=True))
+                deleted += Story.objects.filter(id__in=owned).delete()[0]
+            not_deleted += [key for key in chunk if key not in owned]
+
+        payload = {"deleted": deleted, "not_deleted": not_deleted}
+        return HttpResponse(json.dumps(payload), status=200, content_type="application/json")
+
+    # Delete stories in a date range
+    if "date_from" in batch and "date_to" in batch:
+        # Ensure the date fields are in format dd/mm/yyyy or *
+        for field, lookup in [("date_from", "date__gte"), ("date_to", "date__lte")]:
+            if batch[field] == "*":
+                continue
+            try:
+                user_stories = user_stories.filter(**{lookup: datetime.strptime(batch[field], "%d/%m/%Y").date()})
+            except (TypeError, ValueError):
+                return HttpResponse("Invalid date format", status=503, content_type="text/plain")
+
+        while True:
+            with transaction.atomic():
+                chunk = list(user_stories.values_list("id", flat=True)[:BATCH_DELETE_CHUNK_SIZE])
+                if not chunk:
+                    break
+                deleted += Story.objects.filter(id__in=chunk).delete()[0]
+
+        payload = {"deleted": deleted, "not_deleted": []}
+        return HttpResponse(json.dumps(payload), status=200, content_type="application/json")
+
+    return HttpResponse("Missing required fields", status=503, content_type="text/plain")
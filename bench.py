@@ -0,0 +1,70 @@
+import random
+import time
+
+from api import formats
+
+# Number of stories in the benchmark feed
+FEED_SIZE = 100000
+
+# Number of times each encode/decode is timed, the best time is reported
+REPEATS = 3
+
+
+# Build a feed of random story rows in the order of the story fields
+def make_feed(size):
+    rng = random.Random(0)
+    words = ["election", "budget", "gallery", "robot", "quiz", "minister", "exhibit", "chip", "record", "storm"]
+    rows = []
+    for key in range(1, size + 1):
+        rows.append((
+            key,
+            " ".join(rng.choice(words) for _ in range(6)).capitalize()[:64],
+            rng.choice(["pol", "art", "tech", "trivia"]),
+            rng.choice(["uk", "eu", "w"]),
+            rng.choice(["admin", "ammar", "sc21jjfw"]),
+            f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024",
+            " ".join(rng.choice(words) for _ in range(14))[:128],
+        ))
+    return rows
+
+
+# Time a function, returning its result and the best time in milliseconds
+def best_time(function, *args):
+    best = None
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    rows = make_feed(FEED_SIZE)
+    print(f"Feed of {len(rows)} stories\n")
+    print(f"{'format':<40} {'encoding':<9} {'bytes':>12} {'encode ms':>10} {'decode ms':>10}")
+
+    for media_type in [formats.JSON_TYPE, formats.COLUMNAR_TYPE, formats.MSGPACK_TYPE]:
+        if media_type not in formats.available_types():
+            print(f"{media_type:<40} skipped, msgpack not installed")
+            continue
+        for encoding in [None] + formats.available_encodings():
+            def encode():
+                return formats.compress(formats.encode_stories(rows, media_type), encoding)
+
+            def decode(data):
+                if encoding == "br":
+                    data = formats.brotli.decompress(data)
+                elif encoding == "gzip":
+                    data = formats.gzip.decompress(data)
+                return formats.decode_stories(data, media_type)
+
+            body, encode_ms = best_time(encode)
+            stories, decode_ms = best_time(decode, body)
+            assert len(stories) == len(rows)
+            print(f"{media_type:<40} {encoding or 'none':<9} {len(body):>12} {encode_ms:>10.1f} {decode_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+# WSGI applications compared, the full site and the read-only feed, with the settings module each one uses
+APPS = {"cwk1.wsgi": "cwk1.settings", "cwk1.feed_wsgi": "cwk1.feed_settings"}
+
+# Number of feed requests timed after the first
+REQUESTS = 500
+
+# Number of stories in the benchmark database, about as many as a busy news service's feed returns
+STORIES = 1000
+
+# Settings module for each application, using a temporary seeded database with rate limiting turned off, as every
+# request comes from the same address
+BENCH_SETTINGS = """
+from {settings} import *  # noqa: F401, F403
+from {settings} import DATABASES
+
+DATABASES = {{alias: {{**database, 'NAME': {database!r}}} for alias, database in DATABASES.items()}}
+RATE_LIMIT_RATE = 0
+"""
+
+
+# Build a WSGI environ for a feed request
+def feed_environ():
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/api/stories",
+        "QUERY_STRING": "story_cat=*&story_region=*&story_date=*",
+        "HTTP_HOST": "sc21jjfw.pythonanywhere.com",
+        "wsgi.input": BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    return environ
+
+
+# Send a feed request to a WSGI application, returning the response status
+def request(application):
+    status = []
+    body = application(feed_environ(), lambda response_status, headers: status.append(response_status))
+    b"".join(body)
+    if hasattr(body, "close"):
+        body.close()
+    return status[0]
+
+
+# Time loading an application, its first request and the mean of the following requests, in a fresh process
+def measure(app):
+    start = time.perf_counter()
+    application = __import__(app, fromlist=["application"]).application
+    load_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    status = request(application)
+    first_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        request(application)
+    request_ms = (time.perf_counter() - start) * 1000 / REQUESTS
+
+    print(json.dumps({"load_ms": load_ms, "first_ms": first_ms, "request_ms": request_ms, "status": status}))
+
+
+# Create the tables of the benchmark database and fill it with stories spread over the categories and regions
+def seed():
+    import django
+    django.setup()
+
+    from datetime import date, timedelta
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    from api.models import Author, Story
+
+    call_command("migrate", verbosity=0)
+    author = Author.objects.create(user=User.objects.create_user("author", first_name="Author", password="password"))
+    categories = ["pol", "art", "tech", "trivia"]
+    regions = ["uk", "eu", "w"]
+    Story.objects.bulk_create(
+        Story(headline=f"Story number {number}", category=categories[number % len(categories)],
+              region=regions[number % len(regions)], author=author,
+              date=date(2024, 1, 1) + timedelta(days=number % 365),
+              details=f"Details of story number {number}, long enough to be typical of a story's details")
+        for number in range(STORIES))
+
+
+# Run this script in a fresh process with the benchmark settings for an application
+def run(directory, settings, *args):
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings,
+           "PYTHONPATH": os.pathsep.join(filter(None, [directory, os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    return subprocess.run([sys.executable, __file__, *args], capture_output=True, text=True, check=True,
+                          env=env).stdout
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "bench.sqlite3")
+        for number, settings in enumerate(APPS.values()):
+            with open(os.path.join(directory, f"bench_settings{number}.py"), "w") as settings_file:
+                settings_file.write(BENCH_SETTINGS.format(settings=settings, database=database))
+        run(directory, "bench_settings0", "--seed")
+
+        print(f"Feed of {STORIES} stories, {REQUESTS} requests after the first")
+        print(f"{'app':<16} {'load ms':>8} {'first request ms':>17} {'mean request ms':>16}  status")
+        for number, app in enumerate(APPS):
+            output = run(directory, f"bench_settings{number}", app)
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{app:<16} {result['load_ms']:>8.1f} {result['first_ms']:>17.2f} {result['request_ms']:>16.3f}  "
+                  f"{result['status']}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--seed":
+        seed()
+    elif len(sys.argv) > 1:
+        measure(sys.argv[1])
+    else:
+        main()
@@ -1,41 +1,505 @@
-from datetime import datetime
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from api import formats
 
-class Client:
+# Optional dependency, HTTP/2 is only available if httpx is installed with its http2 extra
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Location of the local story store
+STORE_PATH = os.path.join(os.path.expanduser("~"), ".news_client.sqlite3")
+
+# Seconds after a sync before the local store is refreshed in the background
+STORE_MAX_AGE = 300
+
+# Number of hosts to keep connection pools for, enough for every agency plus the directory service
+POOL_HOSTS = 32
+
+# Number of keep-alive connections to keep open to each host
+POOL_SIZE = 10
+
+# Seconds to wait for a connection to a host and for a response from it
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+
+# Number of recent requests to each host the latency statistics are taken from
+LATENCY_WINDOW = 1000
+
+# Number of times to retry a request that fails to connect or times out, and the base delay between retries
+RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+# Retrying these requests can't change anything on the server, and these statuses are worth retrying
+RETRY_METHODS = ["GET", "HEAD"]
+RETRY_STATUSES = [502, 504]
+
+# Longest Retry-After to wait for when a news service rate limits a request, and the number of times to wait. A news
+# service that limits posts or deletes (RATE_LIMIT_METHODS) can hold a long batch back by its limit many times.
+MAX_RETRY_AFTER = 30
+RATE_LIMIT_RETRIES = 10
+
+# Number of batch operations run at once, and how many are read ahead of those running
+BATCH_CONCURRENCY = 8
+BATCH_READ_AHEAD = 64
+
+# Number of agencies fetched from at once when syncing
+SYNC_CONCURRENCY = 8
+
+# Weight given to the latest request when updating an agency's latency and error rate averages
+HEALTH_EWMA_ALPHA = 0.3
+
+# Consecutive failures before an agency's circuit opens, and seconds it stays open before a probe is allowed
+CIRCUIT_FAILURES = 3
+CIRCUIT_OPEN_SECONDS = 600
+
+# Stories from different agencies with matching headlines are duplicates if dated within this many days
+DUPLICATE_WINDOW_DAYS = 1
+
+# Words ignored when comparing headlines
+HEADLINE_STOP_WORDS = {"a", "an", "and", "as", "at", "by", "for", "from", "in", "is", "of", "on", "the", "to", "with"}
+HEADLINE_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Date formats used by news services for story dates
+STORY_DATE_FORMATS = ['%Y-%m-%d', '%d-%m-%Y', '%m-%d-%Y', '%Y/%m/%d', '%d/%m/%Y', '%m/%d/%Y']
+
+
+# Parse a story date in any of the formats used by news services, returning None if it can't be parsed
+def parse_story_date(value):
+    for format_str in STORY_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, format_str).date()
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+# Normalise a headline so syndicated copies differing in case, punctuation or stop words match. Word order is kept,
+# as "Dog bites man" and "Man bites dog" aren't the same story.
+def headline_key(headline):
+    words = HEADLINE_WORD_RE.findall((headline or "").lower())
+    return " ".join(word for word in words if word not in HEADLINE_STOP_WORDS)
+
+
+# Merge stories from different agencies with matching headlines in a date sorted timeline into the earliest one,
+# recording the other agencies in its also_from list. Runs in linear time using a dictionary of headline keys.
+def dedupe_timeline(stories):
+    timeline = []
+    seen = {}
+    for story in stories:
+        story["also_from"] = []
+        key = headline_key(story["headline"])
+        if not key or story["date"] is None:
+            timeline.append(story)
+            continue
+
+        story_date = datetime.fromisoformat(story["date"]).date()
+        first = seen.get(key)
+        if (first is not None and first["agency_code"] != story["agency_code"]
+                and (story_date - first["parsed_date"]).days <= DUPLICATE_WINDOW_DAYS):
+            first["also_from"].append(story["agency_name"] or story["agency_code"])
+            continue
+
+        story["parsed_date"] = story_date
+        seen[key] = story
+        timeline.append(story)
+    return timeline
+
+
+# Get the state of an agency's circuit breaker from its health record: closed agencies are fetched, open agencies are
+# skipped and half-open agencies get a single probe fetch to see if they have recovered
+def circuit_state(health, now=None):
+    if health is None or health["opened_at"] is None:
+        return "closed"
+    if (now or time.time()) - health["opened_at"] < CIRCUIT_OPEN_SECONDS:
+        return "open"
+    return "half-open"
+
+
+# Print a story from the local store
+def print_story(story):
+    if story["date"] is not None:
+        formatted_date = datetime.strptime(story["date"], "%Y-%m-%d").strftime("%d/%m/%Y")
+    elif story["raw_date"] is not None:
+        formatted_date = story["raw_date"]
+    else:
+        formatted_date = "Not in JSON data"
+
+    print("----------------------------------\n"
+          f"\033[1mKey:\033[0m {story['story_key']}\n"
+          f"\033[1mAgency:\033[0m {story['agency_name']} ({story['agency_code']})\n"
+          f"\033[1mHeadline:\033[0m {story['headline']}\n"
+          f"\033[1mCategory:\033[0m {story['category']}\n"
+          f"\033[1mRegion:\033[0m {story['region']}\n"
+          f"\033[1mAuthor:\033[0m {story['author']}\n"
+          f"\033[1mDate:\033[0m {formatted_date}\n"
+          f"\033[1mDetails:\033[0m {story['details']}")
+    if story.get("also_from"):
+        print(f"\033[1mAlso from:\033[0m {', '.join(story['also_from'])}")
+
+
+# Local SQLite store of stories fetched from every agency, keyed by agency code and story key
+class StoryStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        # SQLite connections can only be used by the thread that created them
+        self.local = threading.local()
+
+        # Create the tables and indexes if they don't exist
+        with self.connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS agencies (
+                    agency_code TEXT PRIMARY KEY,
+                    agency_name TEXT,
+                    url TEXT,
+                    synced_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS stories (
+                    agency_code TEXT NOT NULL,
+                    story_key TEXT NOT NULL,
+                    headline TEXT,
+                    category TEXT,
+                    region TEXT,
+                    author TEXT,
+                    date TEXT,
+                    raw_date TEXT,
+                    details TEXT,
+                    PRIMARY KEY (agency_code, story_key)
+                );
+                CREATE INDEX IF NOT EXISTS stories_date ON stories (date);
+                CREATE INDEX IF NOT EXISTS stories_category_region_date ON stories (category, region, date);
+                CREATE TABLE IF NOT EXISTS agency_health (
+                    agency_code TEXT PRIMARY KEY,
+                    latency_ewma REAL,
+                    error_rate REAL NOT NULL DEFAULT 0,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    last_success REAL,
+                    last_failure REAL,
+                    opened_at REAL
+                );
+            """)
+
+    # Get the connection for the current thread, opening it if required
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            # Allow queries to be answered while a background sync is writing
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    # Save the list of agencies from the directory service, keeping the sync time of known agencies
+    def save_agencies(self, agencies):
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT INTO agencies (agency_code, agency_name, url) VALUES (?, ?, ?) "
+                "ON CONFLICT (agency_code) DO UPDATE SET agency_name = excluded.agency_name, url = excluded.url",
+                [(agency["agency_code"], agency["agency_name"], agency["url"]) for agency in agencies])
+
+    # Get the list of agencies known to the store
+    def get_agencies(self):
+        rows = self.connection().execute("SELECT agency_code, agency_name, url FROM agencies").fetchall()
+        return [dict(row) for row in rows]
+
+    # Get the time of the most recent sync of any agency, or None if the store has never been synced
+    def last_synced(self):
+        return self.connection().execute("SELECT MAX(synced_at) FROM agencies").fetchone()[0]
+
+    # Get the first date that needs fetching to bring an agency up to date, or None if it has never been synced
+    def sync_window_start(self, agency_code):
+        row = self.connection().execute(
+            "SELECT synced_at FROM agencies WHERE agency_code = ?", (agency_code,)).fetchone()
+        if row is None or row["synced_at"] is None:
+            return None
+        # Go back a day so stories posted around midnight in the news service's timezone aren't missed
+        return datetime.fromtimestamp(row["synced_at"]).date() - timedelta(days=1)
+
+    # Save the stories fetched from an agency dated on or after since (or all stories if since is None),
+    # replacing the stored stories in that window so stories deleted from the news service are removed
+    def save_stories(self, agency, stories, since):
+        rows = []
+        for story in stories:
+            if "key" not in story:
+                continue
+            story_date = parse_story_date(story.get("story_date"))
+            rows.append((agency["agency_code"], str(story["key"]), story.get("headline"), story.get("story_cat"),
+                         story.get("story_region"), story.get("author"),
+                         story_date.isoformat() if story_date is not None else None,
+                         story.get("story_date"), story.get("story_details")))
+
+        with self.connection() as conn:
+            if since is None:
+                conn.execute("DELETE FROM stories WHERE agency_code = ?", (agency["agency_code"],))
+            else:
+                conn.execute("DELETE FROM stories WHERE agency_code = ? AND date >= ?",
+                             (agency["agency_code"], since.isoformat()))
+            conn.executemany("INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute(
+                "INSERT INTO agencies (agency_code, agency_name, url, synced_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (agency_code) DO UPDATE SET synced_at = excluded.synced_at",
+                (agency["agency_code"], agency["agency_name"], agency["url"], time.time()))
+        return len(rows)
+
+    # Get the health record of every agency that has been fetched from, keyed by agency code
+    def get_health(self):
+        rows = self.connection().execute("SELECT * FROM agency_health").fetchall()
+        return {row["agency_code"]: dict(row) for row in rows}
+
+    # Update an agency's health record with the outcome of a fetch, opening its circuit if it keeps failing
+    def record_fetch(self, agency_code, seconds, ok):
+        now = time.time()
+        with self.connection() as conn:
+            row = conn.execute("SELECT * FROM agency_health WHERE agency_code = ?", (agency_code,)).fetchone()
+            health = dict(row) if row is not None else {"agency_code": agency_code, "latency_ewma": None,
+                                                        "error_rate": 0.0, "failures": 0, "last_success": None,
+                                                        "last_failure": None, "opened_at": None}
+
+            if health["latency_ewma"] is None:
+                health["latency_ewma"] = seconds
+            else:
+                health["latency_ewma"] += HEALTH_EWMA_ALPHA * (seconds - health["latency_ewma"])
+            health["error_rate"] += HEALTH_EWMA_ALPHA * ((0.0 if ok else 1.0) - health["error_rate"])
+
+            if ok:
+                health["failures"] = 0
+                health["last_success"] = now
+                health["opened_at"] = None
+            else:
+                health["failures"] += 1
+                health["last_failure"] = now
+                # Open the circuit, or reopen it if a half-open probe failed
+                if health["failures"] >= CIRCUIT_FAILURES:
+                    health["opened_at"] = now
+
+            conn.execute("INSERT OR REPLACE INTO agency_health VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (agency_code, health["latency_ewma"], health["error_rate"], health["failures"],
+                          health["last_success"], health["last_failure"], health["opened_at"]))
+
+    # Query stored stories, None filters match everything and date matches stories on or after it
+    def query(self, agency_code=None, category=None, region=None, date=None):
+        conditions = []
+        params = []
+        if agency_code is not None:
+            conditions.append("stories.agency_code = ?")
+            params.append(agency_code)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if region is not None:
+            conditions.append("region = ?")
+            params.append(region)
+        if date is not None:
+            conditions.append("date >= ?")
+            params.append(date.isoformat())
+
+        sql = ("SELECT stories.*, agencies.agency_name FROM stories "
+               "LEFT JOIN agencies ON agencies.agency_code = stories.agency_code")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date, stories.agency_code"
+        return [dict(row) for row in self.connection().execute(sql, params).fetchall()]
+
+
+# Per-host request, error and retry counts and latencies of the most recent requests, shared by every transport of
+# a client
+class TransportStats:
     def __init__(self):
-        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    # Record the outcome of a request to a host
+    def record(self, host, seconds, ok):
+        with self.lock:
+            host_stats = self.host_stats(host)
+            host_stats["requests"] += 1
+            host_stats["latencies"].append(seconds)
+            if not ok:
+                host_stats["errors"] += 1
+
+    # Record a request to a host being retried
+    def record_retry(self, host):
+        with self.lock:
+            self.host_stats(host)["retries"] += 1
+
+    # Get the stats of a host, adding them if it hasn't been seen before. Must be called holding the lock.
+    def host_stats(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {"requests": 0, "errors": 0, "retries": 0,
+                                "latencies": deque(maxlen=LATENCY_WINDOW)}
+        return self.hosts[host]
+
+    # Get a summary of each host, sorted by mean latency
+    def summary(self):
+        rows = []
+        with self.lock:
+            for host, host_stats in self.hosts.items():
+                latencies = sorted(host_stats["latencies"])
+                if not latencies:
+                    continue
+                rows.append({
+                    "host": host,
+                    "requests": host_stats["requests"],
+                    "errors": host_stats["errors"],
+                    "retries": host_stats["retries"],
+                    "mean_ms": sum(latencies) / len(latencies) * 1000,
+                    "p50_ms": latencies[len(latencies) // 2] * 1000,
+                    "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                    "max_ms": latencies[-1] * 1000,
+                })
+        return sorted(rows, key=lambda row: row["mean_ms"])
+
+
+# HTTP transport with pooled keep-alive connections per host, timeouts, retries with jittered backoff and optional
+# HTTP/2, used in place of a requests session
+class Transport:
+    def __init__(self, stats=None, http2=False, pool_size=POOL_SIZE):
+        self.stats = stats or TransportStats()
+        self.http2 = http2
+        if http2:
+            # httpx raises ImportError for HTTP/2 if it was installed without its http2 extra
+            try:
+                if httpx is None:
+                    raise ImportError
+                self.client = httpx.Client(
+                    http2=True, follow_redirects=True,
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=POOL_HOSTS * pool_size, max_keepalive_connections=POOL_HOSTS))
+            except ImportError:
+                raise RuntimeError("HTTP/2 requires httpx to be installed with 'pip install httpx[http2]'") from None
+        else:
+            self.client = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+            self.client.mount("http://", adapter)
+            self.client.mount("https://", adapter)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    # Send a request, retrying idempotent requests that fail to connect, time out or get a gateway error, and any
+    # request rejected by rate limiting. Failures are raised as requests exceptions whichever backend is used.
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).netloc
+        if not self.http2:
+            kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        idempotent = method in RETRY_METHODS
+
+        failures = 0
+        rate_limited = 0
+        delay = 0
+        while True:
+            if failures or rate_limited:
+                self.stats.record_retry(host)
+                time.sleep(delay)
+            # Double the delay before each retry, with full jitter so retries to a host are spread out
+            delay = random.uniform(0, RETRY_BACKOFF * 2 ** failures)
+            can_retry = idempotent and failures < RETRIES
+
+            start = time.perf_counter()
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                self.stats.record(host, time.perf_counter() - start, False)
+                if not can_retry:
+                    raise
+                failures += 1
+                continue
+            except Exception as e:
+                if httpx is None or not isinstance(e, httpx.HTTPError):
+                    raise
+                self.stats.record(host, time.perf_counter() - start, False)
+                if not can_retry:
+                    raise requests.exceptions.ConnectionError(str(e)) from e
+                failures += 1
+                continue
+
+            self.stats.record(host, time.perf_counter() - start, response.status_code < 500)
+
+            # Rate limited requests weren't processed, so can be retried whatever the method once the limit allows
+            if response.status_code == 429 and rate_limited < RATE_LIMIT_RETRIES:
+                try:
+                    delay = min(MAX_RETRY_AFTER, float(response.headers.get("Retry-After", delay)))
+                except ValueError:
+                    pass
+                rate_limited += 1
+                continue
+            if response.status_code in RETRY_STATUSES and can_retry:
+                failures += 1
+                continue
+            return response
+
+
+class Client:
+    def __init__(self, store_path=STORE_PATH, http2=False, pool_size=POOL_SIZE, interactive=True):
+        self.http2 = http2
+        self.transport_stats = TransportStats()
+        self.session = Transport(stats=self.transport_stats, http2=http2, pool_size=pool_size)
         self.logged_in_url = None
-        print("\n\033[1mWelcome to the news aggregator client!\033[0m")
-        print("Type 'help' for a list of commands or 'exit' to close the client.")
+        self.store = StoryStore(store_path)
+        self.interactive = interactive
+        self.sync_thread = None
+        # Ask news services for the most compact story format available, those not supporting it return JSON
+        self.accept_header = f"{formats.COLUMNAR_TYPE};q=0.9, {formats.JSON_TYPE};q=0.5"
+        if formats.msgpack is not None:
+            self.accept_header = f"{formats.MSGPACK_TYPE}, {self.accept_header}"
+        if interactive:
+            print("\n\033[1mWelcome to the news aggregator client!\033[0m")
+            print("Type 'help' for a list of commands or 'exit' to close the client.")
 
-    # Get list of agencies from directory service
-    def get_agencies(self):
+    # Get list of agencies from directory service, printing progress if verbose
+    def get_agencies(self, verbose=True):
         # Fetch list of agencies from directory service
-        print("\n\033[1;34mAttempting to retrieve list of agencies from directory service\033[0m")
+        if verbose:
+            print("\n\033[1;34mAttempting to retrieve list of agencies from directory service\033[0m")
 
         # Send get request to /api/directory endpoint of the directory service
         try:
             response = self.session.get('https://newssites.pythonanywhere.com/api/directory')
         except requests.exceptions.RequestException:
-            print(f"\033[1;31m✘ Unable to connect to directory service\033[0m\n")
+            if verbose:
+                print(f"\033[1;31m✘ Unable to connect to directory service\033[0m\n")
             return
 
         # Handle directory service unable to process request
         if response.status_code != 200:
-            print(f"\033[1;31m✘ Failed to fetch agencies from directory service: (code {response.status_code}): "
-                  f"{response.text}\033[0m\n")
+            if verbose:
+                print(f"\033[1;31m✘ Failed to fetch agencies from directory service: (code {response.status_code}): "
+                      f"{response.text}\033[0m\n")
             return
 
         # Handle no agencies returned
         if len(response.json()) == 0:
-            print("\033[1;31m✘ No agencies found\033[0m\n")
+            if verbose:
+                print("\033[1;31m✘ No agencies found\033[0m\n")
             return
 
         # Parse response text into list of agencies
         agencies = response.json()
-        print(f"\033[1;32m✔ {len(agencies)} agencies found \033[0m")
+        if verbose:
+            print(f"\033[1;32m✔ {len(agencies)} agencies found \033[0m")
 
         return agencies
 
@@ -63,8 +527,7 @@ class Client:
             return
 
         # Strip trailing slash if present
-        if url[-1] == "/":
-            url = url[:-1]
+        url = url.rstrip("/")
 
         print(f"\n\033[1;34mAttempting to log in to news service @ {url}\033[0m")
 
@@ -74,7 +537,7 @@ class Client:
 
         # Send post request to /api/login
         try:
-            response = self.session.post(f'https://{url}/api/login', data={'username': username, 'password': password})
+            response = self.send_login(url, username, password)
         except requests.exceptions.RequestException:
             print(f"\033[1;31m✘ Login failed: unable to connect to news service @ {url}\033[0m\n")
             return
@@ -84,9 +547,15 @@ class Client:
             print(f"\033[1;31m✘ Login failed (code {response.status_code}): {response.text}\033[0m\n")
             return
 
-        # Finished, print success message & set url in global scope
+        # Finished, print success message
         print("\033[1;32m✔ Login successful\033[0m\n")
-        self.logged_in_url = url
+
+    # Send a login request to a news service, remembering its url if successful
+    def send_login(self, url, username, password):
+        response = self.session.post(f'https://{url}/api/login', data={'username': username, 'password': password})
+        if response.status_code == 200:
+            self.logged_in_url = url
+        return response
 
     # Log out of news service
     def logout(self):
@@ -99,7 +568,7 @@ class Client:
 
         # Send post request to /api/login
         try:
-            response = self.session.post(f'https://{self.logged_in_url}/api/logout')
+            response = self.send_logout()
         except requests.exceptions.RequestException:
             print(f"\033[1;31m✘ Logout failed: unable to connect to news service @ {self.logged_in_url}\033[0m\n")
             return
@@ -111,135 +580,237 @@ class Client:
 
         # Finished, print success message
         print("\033[1;32m✔ Logout successful\033[0m\n")
-        self.logged_in_url = None
 
-    # Get news stories from news service(s)
-    def get_stories(self, agency_id=None, category=None, region=None, date=None):
-        # If category, region or date parameters not provided or provided as none set to wildcard "*" for API request
-        if category is None:
-            category = "*"
-        if region is None:
-            region = "*"
-        if date is None:
-            date = "*"
+    # Send a logout request to the news service logged in to, forgetting its url if successful
+    def send_logout(self):
+        response = self.session.post(f'https://{self.logged_in_url}/api/logout')
+        if response.status_code == 200:
+            self.logged_in_url = None
+        return response
 
-        # Get list of agencies from directory service
-        agencies = self.get_agencies()
+    # Fetch stories from a single agency, returning the list of stories or None and an error message
+    def fetch_stories(self, agency, category="*", region="*", date="*", session=None):
+        session = session or self.session
+
+        # Strip trailing slash if present
+        if agency["url"][-1] == "/":
+            agency["url"] = agency["url"][:-1]
+
+        # Send get request to /api/stories endpoint of the news service
+        try:
+            response = session.get(url=f'{agency["url"]}/api/stories?story_cat={category}'
+                                       f'&story_region={region}&story_date={date}',
+                                   headers={'Content-Type': 'application/x-www-form-urlencoded',
+                                            'Accept': self.accept_header})
+        except requests.exceptions.RequestException:
+            return None, f"Unable to connect to news service @ {agency['url']}"
+
+        # Handle successful request but 0 stories returned
+        if response.status_code == 404:
+            return [], None
+
+        # Handle news service unable to process request
+        if response.status_code != 200:
+            # Don't print response text if it is HTML not an error message
+            if response.text.startswith("<!DOCTYPE html>") or response.text.startswith("<html>"):
+                error_msg = "API returned HTML but JSON expected"
+            else:
+                error_msg = response.text
+            return None, (f"Failed to fetch stories from news service @ {agency['url']}: "
+                          f"(code {response.status_code}): {error_msg}")
+
+        # Handle news service return HTML when status code is 200
+        if response.text.startswith("<!DOCTYPE html>") or response.text.startswith("<html>"):
+            return None, f"Failed to fetch stories from news service @ {agency['url']}: " \
+                         f"API returned HTML but JSON expected"
+
+        # Parse response text into list of stories
+        try:
+            stories = formats.decode_stories(response.content, response.headers.get('Content-Type'))
+        except ValueError:
+            return None, f"Failed to fetch stories from news service @ {agency['url']}: invalid story payload " \
+                         f"in response"
+
+        return stories, None
+
+    # Order agencies by health, closed circuits first by error rate then latency and half-open probes last,
+    # returning the agencies to fetch and the agencies skipped because their circuit is open
+    def order_agencies(self, agencies, skip_open=True):
+        health = self.store.get_health()
+        now = time.time()
+        to_fetch = []
+        skipped = []
+        for agency in agencies:
+            state = circuit_state(health.get(agency["agency_code"]), now)
+            if state == "open" and skip_open:
+                skipped.append(agency)
+            else:
+                to_fetch.append(agency)
+
+        # Agencies never fetched from have no latency yet, so are tried after those known to respond quickly
+        def sort_key(agency):
+            record = health.get(agency["agency_code"])
+            if record is None:
+                return False, 0.0, CONNECT_TIMEOUT
+            return (circuit_state(record, now) != "closed", round(record["error_rate"], 1),
+                    record["latency_ewma"])
+
+        return sorted(to_fetch, key=sort_key), skipped
+
+    # Fetch new stories from news service(s) into the local story store, returning a list of errors which is empty if
+    # every agency synced
+    def sync_stories(self, agency_id=None, agencies=None, verbose=True, session=None):
+        # Get list of agencies from directory service, unless syncing agencies already known to the store
+        if agencies is None:
+            agencies = self.get_agencies(verbose=verbose)
+            if agencies is None:
+                return ["Failed to fetch agencies from directory service"]
+            self.store.save_agencies(agencies)
 
         # If id parameter provided, filter list of agencies to only include the one with the matching id
         if agency_id is not None:
-            print(f"\033[1;34mAttempting to retrieve stories from agency with id {agency_id}\033[0m")
             agencies = [agency for agency in agencies if agency["agency_code"] == agency_id]
-            # Ensure agency is found matching id switch
-            if len(agencies) == 0:
-                print("\033[1;31m✘ No agencies found matching id provided\033[0m\n")
-                return
 
-        else:
-            print(f"\033[1;34mAttempting to retrieve stories from all agencies\033[0m")
-            # Ensure agency is found matching id switch
-            if len(agencies) == 0:
-                print("\033[1;31m✘ No agencies found\033[0m\n")
-                return
+        # Ensure agency is found
+        if len(agencies) == 0:
+            if verbose:
+                print("\033[1;31m✘ No agencies found to sync\033[0m\n")
+            return ["No agencies found to sync"]
 
-        # Limit agencies to first 20
-        agencies = agencies[:20]
+        # Order agencies healthiest first and skip those with an open circuit, unless one was asked for by id
+        agencies, skipped = self.order_agencies(agencies, skip_open=agency_id is None)
 
-        # Get stories from each agency
-        for agency in agencies:
-            # Strip trailing slash if present
-            if agency["url"][-1] == "/":
-                agency["url"] = agency["url"][:-1]
+        if verbose:
+            print(f"\033[1;34mSyncing stories from {len(agencies)} agencies into the local store\033[0m")
+            if skipped:
+                print(f"\033[1;33m↷ Skipping {len(skipped)} agencies failing repeatedly: "
+                      f"{', '.join(agency['agency_code'] for agency in skipped)}\033[0m")
 
-            # Send get request to /api/stories endpoint of the news service
-            try:
-                response = self.session.get(url=f'{agency["url"]}/api/stories?story_cat={category}'
-                                                f'&story_region={region}&story_date={date}',
-                                            headers={'Content-Type': 'application/x-www-form-urlencoded'})
-            except requests.exceptions.RequestException:
-                print(f"\033[1;31m✘ Unable to connect to news service @ {agency['url']}\033[0m")
-                continue
+        # Fetch stories newer than the last sync of each agency, or all stories if it has never been synced
+        def fetch(agency, since):
+            date = since.strftime("%d/%m/%Y") if since is not None else "*"
+            start = time.perf_counter()
+            stories, error = self.fetch_stories(agency, date=date, session=session)
+            return stories, error, time.perf_counter() - start
 
-            # Handle successful request but 0 stories returned
-            if response.status_code == 404:
-                print(f"\033[1;32m✔ 0 stories found from {agency['agency_name']} @ {agency['url']}\033[0m")
-                continue
+        # Fetch several agencies at once so slow or dead agencies don't hold up the rest, healthiest first.
+        # The store is only written from this thread, as results arrive.
+        errors = []
+        with ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY) as executor:
+            futures = {}
+            for agency in agencies:
+                since = self.store.sync_window_start(agency["agency_code"])
+                futures[executor.submit(fetch, agency, since)] = (agency, since)
 
-            # Handle news service unable to process request
-            if response.status_code != 200 and response.status_code != 404:
-                # Don't print response text if it is HTML not an error message
-                if response.text.startswith("<!DOCTYPE html>") or response.text.startswith("<html>"):
-                    error_msg = "API returned HTML but JSON expected"
-                else:
-                    error_msg = response.text
-                print(f"\033[1;31m✘ Failed to fetch stories from news service @ {agency['url']}: "
-                      f"(code {response.status_code}): {error_msg}\033[0m")
-                continue
+            for future in as_completed(futures):
+                agency, since = futures[future]
+                stories, error, seconds = future.result()
+                self.store.record_fetch(agency["agency_code"], seconds, stories is not None)
+                if stories is None:
+                    errors.append(error)
+                    if verbose:
+                        print(f"\033[1;31m✘ {error}\033[0m")
+                    continue
 
-            # Handle news service return HTML ewhen status code is 200
-            if response.text.startswith("<!DOCTYPE html>") or response.text.startswith("<html>"):
-                print(f"\033[1;31m✘ Failed to fetch stories from news service @ {agency['url']}: "
-                      f"API returned HTML but JSON expected")
-                continue
+                added = self.store.save_stories(agency, stories, since)
+                if verbose:
+                    print(f"\033[1;32m✔ {added} stories synced from {agency['agency_name']} @ "
+                          f"{agency['url']}\033[0m")
 
-            # Parse response text into list of stories
-            try:
-                payload = response.json()
-                stories = payload['stories']
-            except ValueError:
-                print(f"\033[1;31m✘ Failed to fetch stories from news service @ {agency['url']}: invalid JSON response")
-                continue
-            except KeyError:
-                print(f"\033[1;31m✘ Failed to fetch stories from news service @ {agency['url']}:"
-                      f"invalid or missing keys in JSON response")
-                continue
-            except TypeError:
-                print(f"\033[1;31m✘ Failed to fetch stories from news service @ {agency['url']}: invalid JSON response")
-                continue
+        if verbose:
+            print(f"\033[1;32m✔ Finished syncing stories from {len(agencies)} agencies\033[0m\n")
+        return errors
 
-            # Notify user of number of stories found
-            if len(stories) == 1:
-                print(f"\033[1;32m✔ 1 story found from {agency['agency_name']} @ {agency['url']}\033[0m")
-            else:
-                print(f"\033[1;32m✔ {len(stories)} stories found from {agency['agency_name']} @ {agency['url']}\033[0m")
-
-            # Display list of stories
-            for story in stories:
-                # Format date
-                formats_to_try = ['%Y-%m-%d', '%d-%m-%Y', '%m-%d-%Y', '%Y/%m/%d', '%d/%m/%Y', '%m/%d/%Y']
-                formatted_date = None
-                for format_str in formats_to_try:
-                    try:
-                        date_obj = datetime.strptime(story['story_date'], format_str)
-                        formatted_date = date_obj.strftime('%d/%m/%Y')
-                    except ValueError:
-                        continue
-                    except KeyError:
-                        formatted_date = "Not in JSON data"
-                        break
-                if formatted_date is None:
-                    formatted_date = story['story_date']
+    # Sync stories from all agencies known to the store in a background thread, if a sync isn't already running
+    def start_background_sync(self):
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            return
+        # Use a separate transport so the background thread doesn't share connections with the command being run
+        self.sync_thread = threading.Thread(
+            target=self.sync_stories,
+            kwargs={"agencies": self.store.get_agencies(), "verbose": False,
+                    "session": Transport(stats=self.transport_stats, http2=self.http2)},
+            daemon=True)
+        self.sync_thread.start()
 
-                try:
-                    print("----------------------------------\n"
-                          f"\033[1mKey:\033[0m {story['key']}\n"
-                          f"\033[1mHeadline:\033[0m {story['headline']}\n"
-                          f"\033[1mCategory:\033[0m {story['story_cat']}\n"
-                          f"\033[1mRegion:\033[0m {story['story_region']}\n"
-                          f"\033[1mAuthor:\033[0m {story['author']}\n"
-                          f"\033[1mDate:\033[0m {formatted_date}\n"
-                          f"\033[1mDetails:\033[0m {story['story_details']}")
-                    if story == stories[-1]:
-                        print("----------------------------------")
-                except KeyError:
-                    print(f"\033[1;31m↪ ✘ Failed to read stories: invalid or missing keys in JSON response")
-                    break
-            # End of loop through stories
-        # End of loop through agencies
+    # Get news stories matching the filters from the local story store as a timeline with duplicates merged,
+    # syncing from the news service(s) if required. Dates are dd/mm/yyyy and matches stories on or after them.
+    def query_stories(self, agency_id=None, category=None, region=None, date=None):
+        # Parse the date filter into a date object, raising ValueError if it's invalid
+        date_obj = None
+        if date is not None and date != "*":
+            date_obj = datetime.strptime(date, "%d/%m/%Y").date()
 
-        # Finished, print success message
-        "----------------------------------"
-        print(f"\033[1;32m✔ Finished fetching stories from {len(agencies)} agencies\033[0m\n")
+        # Sync the store in the foreground if it is empty, otherwise refresh it in the background if it is stale
+        last_synced = self.store.last_synced()
+        if last_synced is None:
+            self.sync_stories(verbose=self.interactive)
+        elif time.time() - last_synced > STORE_MAX_AGE:
+            self.start_background_sync()
+
+        # Query stories from the local store
+        stories = self.store.query(agency_code=None if agency_id == "*" else agency_id,
+                                   category=None if category == "*" else category,
+                                   region=None if region == "*" else region,
+                                   date=date_obj)
+
+        # Merge stories syndicated by several agencies into a single timeline entry
+        return dedupe_timeline(stories), len(stories)
+
+    # Get news stories from the local story store and display them
+    def get_stories(self, agency_id=None, category=None, region=None, date=None):
+        start = time.perf_counter()
+        try:
+            stories, found = self.query_stories(agency_id=agency_id, category=category, region=region, date=date)
+        except ValueError:
+            print("\033[1;31mError: Invalid date format, expected dd/mm/yyyy\033[0m")
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        # Notify user of number of stories found
+        duplicates = f", {found - len(stories)} duplicates merged" if found != len(stories) else ""
+        if len(stories) == 1:
+            print(f"\033[1;32m✔ 1 story found in local store ({elapsed_ms:.1f} ms{duplicates})\033[0m")
+        else:
+            print(f"\033[1;32m✔ {len(stories)} stories found in local store ({elapsed_ms:.1f} ms{duplicates})\033[0m")
+
+        # Display list of stories
+        for story in stories:
+            print_story(story)
+        if stories:
+            print("----------------------------------")
+        print("")
+
+    # Print request latency statistics for each host contacted
+    def print_stats(self):
+        rows = self.transport_stats.summary()
+        if not rows:
+            print("\033[1;31mError: No requests made yet\033[0m")
+            return
+
+        print(f"\n\033[1m{'Host':<40} {'Requests':>8} {'Errors':>6} {'Retries':>7} {'Mean ms':>8} {'P50 ms':>8} "
+              f"{'P95 ms':>8} {'Max ms':>8}\033[0m")
+        for row in rows:
+            print(f"{row['host']:<40} {row['requests']:>8} {row['errors']:>6} {row['retries']:>7} "
+                  f"{row['mean_ms']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['max_ms']:>8.1f}")
+        print("")
+
+    # Print the health record of each agency fetched from
+    def print_health(self):
+        health = self.store.get_health()
+        if not health:
+            print("\033[1;31mError: No agencies fetched from yet\033[0m")
+            return
+
+        print(f"\n\033[1m{'Agency':<10} {'Circuit':<9} {'Latency ms':>10} {'Error rate':>10} {'Failures':>8} "
+              f"{'Last success':<19}\033[0m")
+        for agency_code, record in sorted(health.items()):
+            last_success = "never"
+            if record["last_success"] is not None:
+                last_success = datetime.fromtimestamp(record["last_success"]).strftime("%d/%m/%Y %H:%M:%S")
+            print(f"{agency_code:<10} {circuit_state(record):<9} {record['latency_ewma'] * 1000:>10.1f} "
+                  f"{record['error_rate']:>10.2f} {record['failures']:>8} {last_success:<19}")
+        print("")
 
     # Post story to news service
     def post_story(self):
@@ -258,9 +829,8 @@ class Client:
 
         # Send post request to /api/stories
         try:
-            response = self.session.post(url=f'https://{self.logged_in_url}/api/stories',
-                                         json={'headline': headline, 'category': category, 'region': region,
-                                               'details': details})
+            response = self.send_story({'headline': headline, 'category': category, 'region': region,
+                                        'details': details})
         except requests.exceptions.RequestException:
             print(f"\033[1;31m✘ Unable to connect to news service @ {self.logged_in_url}\033[0m\n")
             return
@@ -273,6 +843,10 @@ class Client:
         # Finished, print success message
         print("\033[1;32m✔ Story posted successfully\033[0m\n")
 
+    # Send a story to the news service logged in to
+    def send_story(self, story):
+        return self.session.post(url=f'https://{self.logged_in_url}/api/stories', json=story)
+
     # Delete a news story from news service
     def delete_story(self, story_key=None):
         if self.logged_in_url is None:
@@ -289,7 +863,7 @@ class Client:
 
         # Send delete request to /api/stories/<story_id>
         try:
-            response = self.session.delete(f'https://{self.logged_in_url}/api/stories/{story_key}')
+            response = self.send_delete(story_key)
         except requests.exceptions.RequestException:
             print(f"\033[1;31m✘ Unable to connect to news service @ {self.logged_in_url}\033[0m\n")
             return
@@ -302,10 +876,199 @@ class Client:
         # Finished, print success message
         print("\033[1;32m✔ Story deleted successfully\033[0m\n")
 
+    # Send a request deleting a story, or a list of stories, from the news service logged in to
+    def send_delete(self, story_key=None, story_keys=None):
+        if story_keys is not None:
+            return self.session.delete(f'https://{self.logged_in_url}/api/stories', json={'keys': story_keys})
+        return self.session.delete(f'https://{self.logged_in_url}/api/stories/{story_key}')
+
+    # Delete several news stories from news service in a single batch request
+    def delete_stories(self, story_keys=None):
+        if self.logged_in_url is None:
+            print("\033[1;31mError: Not logged in to a news service\033[0m")
+            return
+
+        # Ensure user has entered story keys
+        if not story_keys:
+            print("\033[1;31mError: No story keys provided\033[0m")
+            return
+
+        print(f"\n\033[1;34mAttempting to delete {len(story_keys)} stories from news service @ "
+              f"{self.logged_in_url}\033[0m")
+
+        # Send delete request to /api/stories with the list of keys
+        try:
+            response = self.send_delete(story_keys=story_keys)
+        except requests.exceptions.RequestException:
+            print(f"\033[1;31m✘ Unable to connect to news service @ {self.logged_in_url}\033[0m\n")
+            return
+
+        # Handle delete request failing
+        if response.status_code != 200:
+            print(f"\033[1;31m✘ Failed to delete stories (code {response.status_code}): {response.text}\033[0m\n")
+            return
+
+        # Parse response into the number of stories deleted and the keys which couldn't be deleted
+        try:
+            result = response.json()
+            deleted = result['deleted']
+            not_deleted = result['not_deleted']
+        except (ValueError, KeyError, TypeError):
+            print(f"\033[1;31m✘ Failed to delete stories: invalid JSON response\033[0m\n")
+            return
+
+        # Finished, print success message
+        print(f"\033[1;32m✔ {deleted} stories deleted successfully\033[0m")
+        if not_deleted:
+            print(f"\033[1;31m✘ Stories not found or not yours: {', '.join(str(key) for key in not_deleted)}\033[0m")
+        print("")
+
+
+# Run one batch operation, returning its result record
+def run_operation(client, line_number, operation):
+    if operation is None:
+        return {"line": line_number, "command": None, "ok": False, "status": None, "error": "Invalid JSON"}
+    result = {"line": line_number, "command": operation.get("command"), "ok": False, "status": None}
+
+    try:
+        command = operation["command"]
+        if command in ("logout", "post", "delete") and client.logged_in_url is None:
+            result["error"] = "Not logged in to a news service"
+            return result
+
+        if command == "login":
+            url = operation["url"].rstrip("/")
+            username = operation.get("username", os.environ.get("NEWS_USERNAME"))
+            password = operation.get("password", os.environ.get("NEWS_PASSWORD"))
+            response = client.send_login(url, username, password)
+            expected = 200
+        elif command == "logout":
+            response = client.send_logout()
+            expected = 200
+        elif command == "post":
+            story = {key: operation[key] for key in ["headline", "category", "region", "details"]}
+            response = client.send_story(story)
+            expected = 201
+        elif command == "delete":
+            if "keys" in operation:
+                response = client.send_delete(story_keys=operation["keys"])
+            else:
+                response = client.send_delete(story_key=operation["key"])
+            expected = 200
+        elif command == "sync":
+            errors = client.sync_stories(agency_id=operation.get("agency_id"), verbose=False)
+            result["ok"] = not errors
+            if errors:
+                result["errors"] = errors
+            return result
+        elif command == "news":
+            stories, _ = client.query_stories(agency_id=operation.get("agency_id"),
+                                              category=operation.get("category"),
+                                              region=operation.get("region"), date=operation.get("date"))
+            result["ok"] = True
+            result["stories"] = [{key: story[key] for key in ["agency_code", "story_key", "headline", "category",
+                                                              "region", "author", "date", "details", "also_from"]}
+                                 for story in stories]
+            return result
+        else:
+            result["error"] = f"Invalid command {command}"
+            return result
+    except KeyError as e:
+        result["error"] = f"Missing field {e}"
+        return result
+    except (TypeError, AttributeError):
+        result["error"] = "Invalid field value type"
+        return result
+    except ValueError:
+        result["error"] = "Invalid date format, expected dd/mm/yyyy"
+        return result
+    except requests.exceptions.RequestException:
+        result["error"] = "Unable to connect to news service"
+        return result
+
+    result["ok"] = response.status_code == expected
+    result["status"] = response.status_code
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        try:
+            result["response"] = response.json()
+        except ValueError:
+            result["response"] = response.text
+    else:
+        result["response"] = response.text
+    return result
+
+
+# Run JSON lines operations from input_file, writing a JSON line result for each to output_file in the same order.
+# Each line is a command, e.g. {"command": "login", "url": ...}, or a story record to post. Consecutive posts and
+# deletes are sent concurrently over the logged in session, other commands run once those before them have finished.
+# Returns whether every operation succeeded.
+def run_batch(client, input_file, output_file, concurrency=BATCH_CONCURRENCY):
+    all_ok = True
+    pending = []
+
+    # Run the pending posts and deletes, writing their results in order
+    def flush(executor):
+        nonlocal all_ok
+        for result in executor.map(lambda item: run_operation(client, *item), pending):
+            all_ok = all_ok and result["ok"]
+            output_file.write(json.dumps(result) + "\n")
+        output_file.flush()
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+
+            # Parse the line, treating records without a command as stories to post
+            try:
+                operation = json.loads(line)
+                if not isinstance(operation, dict):
+                    raise ValueError
+            except ValueError:
+                pending.append((line_number, None))
+                continue
+            operation.setdefault("command", "post")
+
+            if operation["command"] in ("post", "delete"):
+                pending.append((line_number, operation))
+                if len(pending) >= BATCH_READ_AHEAD:
+                    flush(executor)
+            else:
+                flush(executor)
+                pending.append((line_number, operation))
+                flush(executor)
+        flush(executor)
+
+    return all_ok
+
 
 def main():
+    parser = argparse.ArgumentParser(description="News aggregator client, interactive unless --batch is given.")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run JSON lines commands or story records from FILE, or - for stdin, then exit")
+    parser.add_argument("--output", metavar="FILE", help="write JSON lines batch results to FILE instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help=f"number of batch posts and deletes sent at once (default {BATCH_CONCURRENCY})")
+    parser.add_argument("--http2", action="store_true", help="use HTTP/2, requires httpx[http2]")
+    options = parser.parse_args()
+
+    # Run batch operations and exit with status 1 if any failed
+    if options.batch is not None:
+        client = Client(http2=options.http2, pool_size=max(POOL_SIZE, options.concurrency), interactive=False)
+        input_file = sys.stdin if options.batch == "-" else open(options.batch)
+        output_file = sys.stdout if options.output is None else open(options.output, "w")
+        try:
+            all_ok = run_batch(client, input_file, output_file, concurrency=options.concurrency)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not sys.stdout:
+                output_file.close()
+        sys.exit(0 if all_ok else 1)
+
     # Create new client instance
-    client = Client()
+    client = Client(http2=options.http2)
 
     # Loop infinitely to accept user input & run commands until exit command is given
     while True:
@@ -324,7 +1087,10 @@ def main():
         elif command == "post":
             client.post_story()
         elif command == "delete":
-            client.delete_story(story_key=args[0])
+            if len(args) > 1:
+                client.delete_stories(story_keys=args)
+            else:
+                client.delete_story(story_key=args[0])
         elif command == "list":
             client.list_agencies()
         elif command == "news":
@@ -334,14 +1100,29 @@ def main():
                     key, value = arg.split("=")
                     s[key] = value
             client.get_stories(agency_id=s["-id"], category=s["-cat"], region=s["-reg"], date=s["-date"])
+        elif command == "sync":
+            s = {"-id": None}  # Switches for the command
+            for arg in args:
+                if "=" in arg:
+                    key, value = arg.split("=")
+                    s[key] = value
+            client.sync_stories(agency_id=s["-id"])
+        elif command == "stats":
+            client.print_stats()
+        elif command == "health":
+            client.print_health()
         elif command == "help":
             print("\n\033[1;34mAvailable commands:\033[0m\n"
                   "list - List all news agencies registered to the directory service\n"
                   "login <url> - Log in to a news service\n"
                   "logout - Log out of a news service\n"
-                  "news [-id=<agency_id>] [-cat=<category>] [-reg=<region>] [-date=<date>] - Get news stories\n"
+                  "news [-id=<agency_id>] [-cat=<category>] [-reg=<region>] [-date=<date>] - Get news stories from "
+                  "the local store, refreshing it in the background if it is stale\n"
+                  "sync [-id=<agency_id>] - Fetch new stories from news services into the local store\n"
+                  "stats - Show request latency statistics for each host contacted\n"
+                  "health - Show the health of each agency fetched from\n"
                   "post - Post a news story (requires login)\n"
-                  "delete <story_key> - Delete a news story (requires login)\n"
+                  "delete <story_key> [<story_key> ...] - Delete news stories (requires login)\n"
                   "exit - Exit the client\n")
         else:
             print("\033[1;31mError: Invalid command - type 'help' for available commandsd\033[0m")
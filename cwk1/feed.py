@@ -0,0 +1,23 @@
+"""
+Warm up for the read-only story feed workers, see cwk1.feed_settings.
+"""
+
+from django.db import connection
+from django.urls import resolve
+
+from api.models import Story
+
+
+def warm_up(connect=True):
+    # Build the URL resolver and import the views
+    resolve('/api/stories')
+
+    # Compile the feed query so the ORM has loaded everything it needs
+    stories = Story.objects.filter(category='pol', region='uk', date__gte='1900-01-01').order_by('date').values_list(
+        'id', 'headline', 'category', 'region', 'author__user__username', 'date', 'details')[:1]
+    stories.query.sql_with_params()
+
+    # Open the database connection and run the query once, only worth doing if the worker will reuse the connection
+    if connect:
+        connection.ensure_connection()
+        list(stories)
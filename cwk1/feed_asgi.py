@@ -0,0 +1,18 @@
+"""
+ASGI config for the read-only story feed, see cwk1.feed_asgi_settings.
+
+It exposes the ASGI callable as a module-level variable named ``application``, with the URLs and feed query loaded
+in advance. No database connection is opened, as the thread serving the first request wouldn't be the one to use it.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cwk1.feed_asgi_settings')
+
+application = get_asgi_application()
+
+from cwk1.feed import warm_up  # noqa: E402
+
+warm_up(connect=False)
@@ -0,0 +1,13 @@
+"""
+Django settings for the read-only story feed served over ASGI, see cwk1.feed_settings.
+
+Sync views run in a thread pool under ASGI, so a connection kept open between requests isn't reliably reused and
+persistent connections aren't recommended. Each request opens and closes its own connection instead.
+"""
+
+from cwk1.feed_settings import *  # noqa: F401, F403
+from cwk1.feed_settings import DATABASES
+
+DATABASES = {alias: {**database, 'CONN_MAX_AGE': 0} for alias, database in DATABASES.items()}
+
+ASGI_APPLICATION = 'cwk1.feed_asgi.application'
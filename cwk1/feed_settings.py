@@ -0,0 +1,36 @@
+"""
+Django settings for the read-only story feed.
+
+Shares the database and api models with cwk1.settings, but only loads the apps the feed needs and runs no
+middleware, so workers start faster and each request does less work. Deploy with cwk1.feed_wsgi, or with
+cwk1.feed_asgi which uses cwk1.feed_asgi_settings.
+"""
+
+from cwk1.settings import *  # noqa: F401, F403
+from cwk1.settings import DATABASES
+
+# auth and contenttypes are needed for the story author's username
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'api.apps.ApiConfig',
+]
+
+# The feed is read only and anonymous, so needs no sessions, authentication or CSRF protection, only replica pinning
+# for clients that have just written through the full site
+MIDDLEWARE = [
+    'cwk1.routers.ReplicaPinningMiddleware',
+]
+
+ROOT_URLCONF = 'cwk1.feed_urls'
+
+TEMPLATES = []
+
+WSGI_APPLICATION = 'cwk1.feed_wsgi.application'
+
+# Keep database connections open between requests rather than reconnecting for every request, see
+# cwk1.feed_asgi_settings for ASGI
+DATABASES = {alias: {**database, 'CONN_MAX_AGE': 600} for alias, database in DATABASES.items()}
+
+# The feed has no translated text
+USE_I18N = False
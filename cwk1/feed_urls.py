@@ -0,0 +1,12 @@
+"""
+URL configuration for the read-only story feed, see cwk1.feed_settings.
+"""
+from django.urls import path
+from django.views.decorators.http import require_GET
+
+import api.views
+
+# Only GET is allowed as there is no authentication middleware to post or delete stories
+urlpatterns = [
+    path('api/stories', require_GET(api.views.stories)),
+]
@@ -0,0 +1,19 @@
+"""
+WSGI config for the read-only story feed, see cwk1.feed_settings.
+
+It exposes the WSGI callable as a module-level variable named ``application``, warmed up so a worker's first
+request is as fast as the rest. Don't load it before forking workers (e.g. gunicorn --preload), as the database
+connection opened by the warm up mustn't be shared between processes.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cwk1.feed_settings')
+
+application = get_wsgi_application()
+
+from cwk1.feed import warm_up  # noqa: E402
+
+warm_up()
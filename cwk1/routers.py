@@ -0,0 +1,65 @@
+"""
+Database routing for read replicas.
+
+Reads of api models go to a random replica from settings.DATABASE_REPLICAS, unless the request is pinned to the
+primary database. ReplicaPinningMiddleware pins every request that isn't a GET or HEAD, and sets a cookie that
+pins the same client's requests for settings.REPLICA_LAG_SECONDS afterwards, so they read their own writes while
+the replicas catch up.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Whether reads in the current request must go to the primary database
+pinned_to_primary = ContextVar("pinned_to_primary", default=False)
+
+# Cookie holding the time until which a client's reads go to the primary database
+PIN_COOKIE = "primary_until"
+
+
+class ReplicaRouter:
+    # Sessions and users are only read from the primary, as a replica lagging behind could log users out
+    replica_apps = {"api"}
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if not replicas or pinned_to_primary.get() or model._meta.app_label not in self.replica_apps:
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
+
+
+class ReplicaPinningMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Pin writes, and reads from clients that wrote recently, to the primary database
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        writing = request.method not in ("GET", "HEAD")
+        token = pinned_to_primary.set(writing or pinned_until > time.time())
+
+        try:
+            response = self.get_response(request)
+        finally:
+            pinned_to_primary.reset(token)
+
+        # Keep reading from the primary database until the replicas have caught up with this write
+        if writing:
+            response.set_cookie(PIN_COOKIE, str(time.time() + settings.REPLICA_LAG_SECONDS),
+                                max_age=settings.REPLICA_LAG_SECONDS, httponly=True, samesite="Lax")
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'cwk1.routers.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'cwk1.urls'
@@ -81,6 +83,28 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database, given as a comma separated list of database names in NEWS_REPLICA_DBS.
+# Story reads are spread over them, except for clients that wrote within the last REPLICA_LAG_SECONDS.
+
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('NEWS_REPLICA_DBS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': name}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['cwk1.routers.ReplicaRouter']
+
+REPLICA_LAG_SECONDS = 5
+
+# Story requests allowed per second for each client on average, in bursts of up to RATE_LIMIT_BURST. The buckets are
+# kept in each worker's memory by LocalStore, or shared by all workers through the RATE_LIMIT_CACHE cache by CacheStore.
+# Only feed polling is limited, posts and deletes need a login and aren't limited unless added to RATE_LIMIT_METHODS.
+
+RATE_LIMIT_RATE = 10
+RATE_LIMIT_BURST = 50
+RATE_LIMIT_METHODS = ['GET']
+RATE_LIMIT_STORE = 'api.throttling.LocalStore'
+RATE_LIMIT_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
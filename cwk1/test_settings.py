@@ -0,0 +1,28 @@
+"""
+Django settings for running the tests, with a primary and a replica database in separate SQLite files.
+
+The replica isn't a mirror of the primary, so rows written to one don't appear in the other, as if the replica
+were lagging behind. The replica routing tests are skipped unless the tests are run with:
+
+    python manage.py test api --settings=cwk1.test_settings
+"""
+
+from cwk1.settings import *  # noqa: F401, F403
+from cwk1.settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_primary.sqlite3'},
+    },
+    'replica1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_replica.sqlite3'},
+    },
+}
+
+DATABASE_REPLICAS = ['replica1']
+
+ALLOWED_HOSTS = ['testserver']
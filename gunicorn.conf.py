@@ -0,0 +1,41 @@
+"""
+Gunicorn multi-worker deployment profile.
+
+Full site, with synchronous workers:
+
+    gunicorn cwk1.wsgi
+
+Read-only story feed (see cwk1.feed_settings), with synchronous or uvicorn workers:
+
+    gunicorn cwk1.feed_wsgi
+    gunicorn cwk1.feed_asgi -k uvicorn.workers.UvicornWorker
+
+Read replicas are given as a comma separated list of database names, story reads are spread over them and clients
+that posted or deleted a story read from the primary for REPLICA_LAG_SECONDS afterwards (see cwk1.routers):
+
+    NEWS_REPLICA_DBS=/srv/news/replica1.sqlite3,/srv/news/replica2.sqlite3 gunicorn cwk1.feed_wsgi
+
+The number of workers can be changed with the WEB_CONCURRENCY environment variable.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# One worker per core plus one, as the feed is mostly waiting on the database
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() + 1))
+
+# Each worker must load the app itself so its database connections aren't shared with the other workers
+preload_app = False
+
+# Keep connections from aggregators polling the feed open between requests
+keepalive = 30
+
+# Restart workers after a while to bound memory growth, staggered so they don't all restart at once
+max_requests = 10000
+max_requests_jitter = 1000
+
+timeout = 30
+graceful_timeout = 30
+
+accesslog = "-"